@@ -1,6 +1,8 @@
 import numpy as np
 from PIL import Image
 
+from vectorized import CHUNK_ELEMENTS
+
 # Image dimensions
 WIDTH, HEIGHT = 500, 500
 
@@ -41,26 +43,30 @@ def trace_ray(origin, direction, spheres):
         return np.array([255, 255, 255])  # Background color (white)
     return closest_sphere.color
 
+# Spheres in the scene
+def default_spheres():
+    return [
+        Sphere([0, -1, 3], 1, [255, 0, 0]),   # Red sphere
+        Sphere([2, 0, 4], 1, [0, 0, 255]),   # Blue sphere
+        Sphere([-2, 0, 4], 1, [0, 255, 0])   # Green sphere
+    ]
+
 # Main rendering function
-def render():
+def render(width=WIDTH, height=HEIGHT, spheres=None):
     camera = np.array([0, 0, 0])  # Camera position
     viewport_size = 1
     projection_plane_z = 1
-    aspect_ratio = WIDTH / HEIGHT
-    image = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    aspect_ratio = width / height
+    image = np.zeros((height, width, 3), dtype=np.uint8)
 
-    # Spheres in the scene
-    spheres = [
-        Sphere([0, -1, 3], 1, [255, 0, 0]),   # Red sphere
-        Sphere([2, 0, 4], 1, [0, 0, 255]),   # Blue sphere
-        Sphere([-2, 0, 4], 1, [0, 255, 0])   # Green sphere
-    ]
+    if spheres is None:
+        spheres = default_spheres()
 
-    for x in range(WIDTH):
-        for y in range(HEIGHT):
+    for x in range(width):
+        for y in range(height):
             # Convert pixel to viewport coordinates
-            px = (x - WIDTH / 2) * viewport_size / WIDTH
-            py = -(y - HEIGHT / 2) * viewport_size / WIDTH / aspect_ratio
+            px = (x - width / 2) * viewport_size / width
+            py = -(y - height / 2) * viewport_size / width / aspect_ratio
             direction = np.array([px, py, projection_plane_z])
             direction = direction / np.linalg.norm(direction)  # Normalize the direction
             color = trace_ray(camera, direction, spheres)
@@ -68,9 +74,51 @@ def render():
 
     return image
 
+# Vectorized rendering function: the same image as render(), computed for
+# whole blocks of rows at once with NumPy instead of pixel by pixel
+def render_vectorized(width=WIDTH, height=HEIGHT, spheres=None, chunk_elements=CHUNK_ELEMENTS):
+    viewport_size = 1
+    projection_plane_z = 1
+    aspect_ratio = width / height
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+
+    if spheres is None:
+        spheres = default_spheres()
+    # The camera sits at the origin, so origin - center is -center for every ray.
+    oc = -np.array([sphere.center for sphere in spheres], dtype=float)
+    radii = np.array([sphere.radius for sphere in spheres], dtype=float)
+    colors = np.array([sphere.color for sphere in spheres] + [[255, 255, 255]])  # Last entry: background
+    c = (oc[:, 0] * oc[:, 0] + oc[:, 1] * oc[:, 1] + oc[:, 2] * oc[:, 2]) - radii**2
+
+    # Same arithmetic as the per-pixel loop, so the results match bit for bit
+    px = (np.arange(width) - width / 2) * viewport_size / width
+    py = -(np.arange(height) - height / 2) * viewport_size / width / aspect_ratio
+    rows = max(1, chunk_elements // (width * len(spheres)))
+    for y0 in range(0, height, rows):
+        x, y = np.meshgrid(px, py[y0:y0 + rows])
+        z = np.full_like(x, projection_plane_z)
+        norm = np.sqrt(x * x + y * y + z * z)
+        d = np.stack((x / norm, y / norm, z / norm), axis=-1)[..., None, :]  # (rows, width, 1, 3)
+
+        a = (d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1] + d[..., 2] * d[..., 2])
+        b = 2.0 * (oc[:, 0] * d[..., 0] + oc[:, 1] * d[..., 1] + oc[:, 2] * d[..., 2])
+        discriminant = b**2 - 4 * a * c
+        sqrt_disc = np.sqrt(np.maximum(discriminant, 0.0))
+        t1 = (-b - sqrt_disc) / (2 * a)
+        t2 = (-b + sqrt_disc) / (2 * a)
+        t = np.where(t1 > 0, t1, np.where(t2 > 0, t2, np.inf))
+        t[discriminant < 0] = np.inf
+
+        # argmin keeps the first of equal distances, like the strict < in trace_ray
+        nearest = np.argmin(t, axis=-1)
+        hit = np.take_along_axis(t, nearest[..., None], axis=-1)[..., 0] < np.inf
+        image[y0:y0 + rows] = colors[np.where(hit, nearest, len(spheres))]
+
+    return image
+
 # Save the rendered image
 if __name__ == "__main__":
-    image = render()
+    image = render_vectorized()
     img = Image.fromarray(image, 'RGB')
     img.save('rendered_scene.png')
     img.show()
@@ -1,5 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
+
+from vectorized import CHUNK_ELEMENTS, PackedScene, add_light
 
 # Define the Sphere and Light objects
 class Sphere:
@@ -99,6 +100,64 @@ def render(scene, width, height, fov):
             image[y, x] = color
     return image
 
+# Batched rendering: the scene is packed into arrays once and every step of
+# trace_ray runs for a block of rows at a time
+def closest_intersection_batch(D, t_min, packed):
+    """Nearest hit for rays from the origin with directions D (..., 3): (sphere index, t), index -1 if none."""
+    CO = -packed.centers                                  # (S, 3); the camera is at the origin
+    a = np.sum(D * D, axis=-1)[..., None]                 # (..., 1)
+    b = 2 * np.einsum('...k,sk->...s', D, CO)             # (..., S)
+    c = np.sum(CO * CO, axis=-1) - packed.radii ** 2      # (S,)
+    discriminant = b ** 2 - 4 * a * c
+    sqrt_disc = np.sqrt(np.maximum(discriminant, 0.0))
+    t1 = (-b + sqrt_disc) / (2 * a)
+    t2 = (-b - sqrt_disc) / (2 * a)
+    t1 = np.where(t1 > t_min, t1, np.inf)
+    t2 = np.where(t2 > t_min, t2, np.inf)
+    t = np.where(discriminant < 0, np.inf, np.minimum(t1, t2))
+    index = np.argmin(t, axis=-1)
+    closest_t = np.take_along_axis(t, index[..., None], axis=-1)[..., 0]
+    return np.where(np.isfinite(closest_t), index, -1), closest_t
+
+def render_vectorized(scene, width, height, fov, chunk_elements=CHUNK_ELEMENTS):
+    """Same image as render() within float tolerance, computed with NumPy for blocks of rows."""
+    packed = PackedScene(scene)
+    if len(packed.radii) == 0:
+        return np.full((height, width, 3), 255.0)
+    aspect_ratio = width / height
+    viewport_height = 1.0
+    viewport_width = viewport_height * aspect_ratio
+    image = np.zeros((height, width, 3))
+
+    px = (np.arange(width) + 0.5) / width * viewport_width - viewport_width / 2
+    py = -(np.arange(height) + 0.5) / height * viewport_height + viewport_height / 2
+    per_pixel = max(len(packed.radii), len(packed.point_intensities), len(packed.direction_intensities), 1)
+    rows = max(1, chunk_elements // (width * per_pixel))
+    for y0 in range(0, height, rows):
+        x, y = np.meshgrid(px, py[y0:y0 + rows])
+        D = np.stack((x, y, np.ones_like(x)), axis=-1)
+        D = D / np.linalg.norm(D, axis=-1, keepdims=True)
+        block = np.full(D.shape, 255.0)  # Background color (white)
+
+        index, closest_t = closest_intersection_batch(D, 1, packed)
+        hit = index >= 0
+        D, index, closest_t = D[hit], index[hit], closest_t[hit]
+        P = closest_t[:, None] * D
+        N = P - packed.centers[index]
+        N = N / np.linalg.norm(N, axis=-1, keepdims=True)
+        V = -D
+        s = packed.specular[index]
+
+        i = np.full(len(index), packed.ambient, dtype=float)
+        L = packed.point_positions - P[:, None, :]
+        add_light(i, N, V, s, L / np.linalg.norm(L, axis=-1, keepdims=True), packed.point_intensities)
+        L = np.broadcast_to(packed.directions, (len(index),) + packed.directions.shape)
+        add_light(i, N, V, s, L, packed.direction_intensities)
+
+        block[hit] = np.clip(packed.colors[index] * i[:, None], 0, 255)
+        image[y0:y0 + rows] = block
+    return image
+
 # Define the scene
 scene = {
     "spheres": [
@@ -115,9 +174,12 @@ scene = {
 }
 
 # Render and display the image
-width, height = 800, 800
-fov = np.pi / 3
-image = render(scene, width, height, fov)
-plt.imshow(image / 255)
-plt.axis('off')
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    width, height = 800, 800
+    fov = np.pi / 3
+    image = render_vectorized(scene, width, height, fov)
+    # Matplotlib is only needed for the preview window
+    import matplotlib.pyplot as plt
+    plt.imshow(image / 255)
+    plt.axis('off')
+    plt.show()
@@ -1,5 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
+
+from vectorized import CHUNK_ELEMENTS, PackedScene, add_light
 
 # Define the Sphere and Light objects
 class Sphere:
@@ -21,19 +22,28 @@ class Light:
 def reflect_ray(L, N):
     return 2 * N * np.dot(N, L) - L
 
-def compute_lighting(P, N, V, s, lights, spheres):
+def compute_lighting(P, N, V, s, lights, spheres, blockers=None):
+    """blockers maps each light to the sphere that last shadowed it, which is tested first."""
+    if blockers is None:
+        blockers = {}
     i = 0  # Accumulated intensity
     for light in lights:
         if light.light_type == "ambient":
             i += light.intensity
         else:
-            # Compute light vector
-            L = light.direction if light.light_type == "directional" else light.position - P
+            # Compute light vector; shadow rays to a point light stop at the light.
+            if light.light_type == "directional":
+                L = light.direction
+                t_max = np.inf
+            else:
+                L = light.position - P
+                t_max = np.linalg.norm(L)
             L = L / np.linalg.norm(L)
 
             # Shadow check
-            shadow_sphere, shadow_t = closest_intersection(P, L, 0.001, np.inf, spheres)
-            if shadow_sphere is not None:
+            blocker = find_occluder(P, L, 0.001, t_max, spheres, blockers.get(light))
+            if blocker is not None:
+                blockers[light] = blocker
                 continue
 
             # Diffuse reflection
@@ -62,6 +72,23 @@ def closest_intersection(O, D, t_min, t_max, spheres):
             closest_sphere = sphere
     return closest_sphere, closest_t
 
+def find_occluder(O, D, t_min, t_max, spheres, first=None):
+    """Return any sphere the ray crosses between t_min and t_max, or None.
+
+    Unlike closest_intersection this stops at the first blocker found. The
+    sphere first, if given, is tested before the others."""
+    if first is not None:
+        t1, t2 = intersect_ray_sphere(O, D, first)
+        if t_min < t1 < t_max or t_min < t2 < t_max:
+            return first
+    for sphere in spheres:
+        if sphere is first:
+            continue
+        t1, t2 = intersect_ray_sphere(O, D, sphere)
+        if t_min < t1 < t_max or t_min < t2 < t_max:
+            return sphere
+    return None
+
 def intersect_ray_sphere(O, D, sphere):
     CO = O - sphere.center
     a = np.dot(D, D)
@@ -75,7 +102,7 @@ def intersect_ray_sphere(O, D, sphere):
     return t1, t2
 
 # Ray tracing function with reflections
-def trace_ray(O, D, t_min, t_max, spheres, lights, recursion_depth):
+def trace_ray(O, D, t_min, t_max, spheres, lights, recursion_depth, blockers=None):
     closest_sphere, closest_t = closest_intersection(O, D, t_min, t_max, spheres)
     if closest_sphere is None:
         return np.array([0, 0, 0])  # Background color (white)
@@ -84,7 +111,7 @@ def trace_ray(O, D, t_min, t_max, spheres, lights, recursion_depth):
     P = O + closest_t * D
     N = (P - closest_sphere.center) / np.linalg.norm(P - closest_sphere.center)
     V = -D
-    local_color = closest_sphere.color * compute_lighting(P, N, V, closest_sphere.specular, lights, spheres)
+    local_color = closest_sphere.color * compute_lighting(P, N, V, closest_sphere.specular, lights, spheres, blockers)
 
     # If recursion depth is 0 or the sphere is not reflective, return local color
     r = closest_sphere.reflective
@@ -93,7 +120,7 @@ def trace_ray(O, D, t_min, t_max, spheres, lights, recursion_depth):
 
     # Compute reflected color
     R = reflect_ray(-D, N)
-    reflected_color = trace_ray(P, R, 0.001, np.inf, spheres, lights, recursion_depth - 1)
+    reflected_color = trace_ray(P, R, 0.001, np.inf, spheres, lights, recursion_depth - 1, blockers)
     return local_color * (1 - r) + reflected_color * r
 
 # Render the scene
@@ -103,6 +130,8 @@ def render(scene, width, height, fov, recursion_depth):
     viewport_height = 1.0
     viewport_width = viewport_height * aspect_ratio
     image = np.zeros((height, width, 3))
+    # Neighbouring pixels tend to be shadowed by the same sphere.
+    blockers = {}
 
     for y in range(height):
         for x in range(width):
@@ -110,10 +139,111 @@ def render(scene, width, height, fov, recursion_depth):
             py = -(y + 0.5) / height * viewport_height + viewport_height / 2
             D = np.array([px, py, 1])
             D = D / np.linalg.norm(D)
-            color = trace_ray(camera, D, 1, np.inf, scene['spheres'], scene['lights'], recursion_depth)
+            color = trace_ray(camera, D, 1, np.inf, scene['spheres'], scene['lights'], recursion_depth, blockers)
             image[y, x] = color
     return image
 
+# Batched rendering: the scene is packed into arrays once, and reflections
+# are traced breadth first, one batch of rays per recursion level
+def intersect_batch(O, D, packed):
+    """Both roots (t1, t2) of every ray (..., 3) against every sphere, shape (..., S); inf for a miss."""
+    CO = O[..., None, :] - packed.centers
+    a = np.sum(D * D, axis=-1)[..., None]
+    b = 2 * np.sum(CO * D[..., None, :], axis=-1)
+    c = np.sum(CO * CO, axis=-1) - packed.radii ** 2
+    discriminant = b ** 2 - 4 * a * c
+    sqrt_disc = np.sqrt(np.maximum(discriminant, 0.0))
+    miss = discriminant < 0
+    t1 = np.where(miss, np.inf, (-b + sqrt_disc) / (2 * a))
+    t2 = np.where(miss, np.inf, (-b - sqrt_disc) / (2 * a))
+    return t1, t2
+
+def closest_intersection_batch(O, D, t_min, packed):
+    """Nearest hit for rays (N, 3): (sphere index, t), index -1 if none."""
+    t1, t2 = intersect_batch(O, D, packed)
+    t = np.minimum(np.where(t1 > t_min, t1, np.inf), np.where(t2 > t_min, t2, np.inf))
+    index = np.argmin(t, axis=-1)
+    closest_t = np.take_along_axis(t, index[:, None], axis=-1)[:, 0]
+    return np.where(np.isfinite(closest_t), index, -1), closest_t
+
+def occluded_batch(P, L, t_max, packed):
+    """For shadow rays from P (N, 3) along unit vectors L (N, K, 3): (N, K) mask of rays a sphere blocks."""
+    t1, t2 = intersect_batch(np.broadcast_to(P[:, None, :], L.shape), L, packed)
+    t_max = t_max[..., None]
+    return np.any(((0.001 < t1) & (t1 < t_max)) | ((0.001 < t2) & (t2 < t_max)), axis=-1)
+
+def compute_lighting_batch(P, N, V, s, packed):
+    """compute_lighting for arrays of points, normals, view vectors and specular exponents."""
+    i = np.full(len(P), packed.ambient, dtype=float)
+    L = packed.point_positions - P[:, None, :]
+    distance = np.linalg.norm(L, axis=-1)
+    L = L / distance[..., None]
+    add_light(i, N, V, s, L, packed.point_intensities, ~occluded_batch(P, L, distance, packed))
+    L = np.broadcast_to(packed.directions, (len(P),) + packed.directions.shape)
+    t_max = np.full(L.shape[:2], np.inf)
+    add_light(i, N, V, s, L, packed.direction_intensities, ~occluded_batch(P, L, t_max, packed))
+    return i
+
+def trace_rays_batch(O, D, t_min, packed, recursion_depth):
+    """trace_ray for rays (N, 3), breadth first.
+
+    Each level intersects and shades one batch of rays; hits on reflective
+    spheres spawn the next level's batch. Colors are then blended back from
+    the deepest level up, using each hit sphere's reflective weight."""
+    levels = []
+    rays = np.arange(len(D))
+    while len(rays):
+        index, closest_t = closest_intersection_batch(O, D, t_min, packed)
+        hit = index >= 0
+        rays, O, D, index, closest_t = rays[hit], O[hit], D[hit], index[hit], closest_t[hit]
+        P = O + closest_t[:, None] * D
+        N = P - packed.centers[index]
+        N = N / np.linalg.norm(N, axis=-1, keepdims=True)
+        local_color = packed.colors[index] * compute_lighting_batch(P, N, -D, packed.specular[index], packed)[:, None]
+
+        r = packed.reflective[index]
+        reflect = r > 0 if len(levels) < recursion_depth else np.zeros(len(rays), dtype=bool)
+        levels.append((rays, local_color, r, reflect))
+        # Reflected rays of this level; rays holds each one's position in the level above
+        N, D = N[reflect], -D[reflect]
+        O, D, rays = P[reflect], 2 * N * np.sum(N * D, axis=-1, keepdims=True) - D, np.flatnonzero(reflect)
+        t_min = 0.001
+
+    colors = None
+    for rays, local_color, r, reflect in reversed(levels):
+        color = local_color
+        if colors is not None:
+            reflected_color = np.zeros_like(local_color)  # Background color (black)
+            reflected_color[colors[0]] = colors[1]
+            color = np.where(reflect[:, None], local_color * (1 - r[:, None]) + reflected_color * r[:, None],
+                             local_color)
+        colors = (rays, color)
+    return colors
+
+def render_vectorized(scene, width, height, fov, recursion_depth, chunk_elements=CHUNK_ELEMENTS):
+    """Same image as render() within float tolerance, traced in batches for blocks of rows."""
+    packed = PackedScene(scene)
+    aspect_ratio = width / height
+    viewport_height = 1.0
+    viewport_width = viewport_height * aspect_ratio
+    image = np.zeros((height, width, 3))  # Background color (black)
+    if len(packed.radii) == 0:
+        return image
+
+    px = (np.arange(width) + 0.5) / width * viewport_width - viewport_width / 2
+    py = -(np.arange(height) + 0.5) / height * viewport_height + viewport_height / 2
+    lights = max(len(packed.point_intensities), len(packed.direction_intensities), 1)
+    rows = max(1, chunk_elements // (width * len(packed.radii) * lights))
+    for y0 in range(0, height, rows):
+        x, y = np.meshgrid(px, py[y0:y0 + rows])
+        D = np.stack((x, y, np.ones_like(x)), axis=-1).reshape(-1, 3)
+        D = D / np.linalg.norm(D, axis=-1, keepdims=True)
+        rays, color = trace_rays_batch(np.zeros_like(D), D, 1, packed, recursion_depth)
+        block = np.zeros_like(D)
+        block[rays] = color
+        image[y0:y0 + rows] = block.reshape(-1, width, 3)
+    return image
+
 # Define the scene
 scene = {
     "spheres": [
@@ -130,10 +260,13 @@ scene = {
 }
 
 # Render and display the image
-width, height = 300, 300
-fov = np.pi / 3
-recursion_depth = 3  # Change this value to control the reflection depth
-image = render(scene, width, height, fov, recursion_depth)
-plt.imshow(image / 255)
-plt.axis('off')
-plt.show()
+if __name__ == "__main__":
+    width, height = 300, 300
+    fov = np.pi / 3
+    recursion_depth = 3  # Change this value to control the reflection depth
+    image = render_vectorized(scene, width, height, fov, recursion_depth)
+    # Matplotlib is only needed for the preview window
+    import matplotlib.pyplot as plt
+    plt.imshow(image / 255)
+    plt.axis('off')
+    plt.show()
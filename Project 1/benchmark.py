@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""Benchmark harness for the CPU ray tracers in this directory.
+
+Each renderer is swept one parameter at a time around a base case (sphere
+count, resolution, samples per pixel, max depth and worker count, where the
+renderer has them). Every case runs in a fresh subprocess so that peak RSS is
+per case. Results are printed, or written with --output, as JSON.
+
+rays_per_second counts camera (primary) rays: width * height * samples per
+pixel, divided by the wall time of the render itself (scene building and
+imports are excluded). For the project 1 worker sweep,
+scaling_efficiency is speedup over one worker divided by the worker count.
+The coincident case stacks every small sphere on one spot, which the BVH
+has to split at the median instead of degenerating into a list.
+
+Use --save-baseline to store a run and --baseline to compare a later run
+against it. Cases that are slower than the baseline by more than --tolerance
+are reported as regressions and make the script exit with status 1.
+
+--denoise-study runs a separate comparison for project 1 instead. It renders
+with and without the denoiser at a few sample counts, measures the error of
+each image against a high-sample reference, and reports how many plain
+samples per pixel give the same error as each denoised render. It also
+reports the resulting equal-quality speedup.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import render_assignment
+
+SCRIPTS = {
+    "project1": "project 1.py",
+    "assignment1": "assignment 1.py",
+    "assignment2": "assignment 2.py",
+    "assignment3": "assignment 3.py",
+}
+
+# Base case for each renderer; the sweeps vary one of these at a time.
+BASE_CASES = {
+    "project1": {"spheres": 480, "width": 80, "height": 40, "spp": 4, "max_depth": 10, "workers": 1},
+    "assignment1": {"spheres": 3, "width": 100, "height": 100},
+    "assignment2": {"spheres": 4, "width": 100, "height": 100},
+    "assignment3": {"spheres": 4, "width": 100, "height": 100, "max_depth": 3},
+}
+
+# Assignments with a NumPy whole-frame renderer next to the per-pixel one; both are swept.
+VECTORIZED = ("assignment1", "assignment2", "assignment3")
+
+def load_script(renderer):
+    """Import one of the renderer scripts."""
+    return render_assignment.load_script(renderer, SCRIPTS[renderer])
+
+def extra_spheres(count, seed=0):
+    """(center, radius, color) for count small spheres scattered in front of the assignment cameras."""
+    rng = random.Random(seed)
+    spheres = []
+    for _ in range(count):
+        z = rng.uniform(3.0, 12.0)
+        center = (rng.uniform(-0.5, 0.5) * z, rng.uniform(-0.5, 0.5) * z, z)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        spheres.append((center, rng.uniform(0.05, 0.3), color))
+    return spheres
+
+#########################
+# Renderer Runners
+#########################
+# Each runner builds the scene for one case, renders it and returns
+# (primary rays, seconds spent rendering, extra fields for the result).
+def run_project1(case):
+    p1 = load_script("project1")
+    grid = max(1, round(math.sqrt(case["spheres"]) / 2))
+    world = p1.random_scene(use_bvh=False, seed=0, grid=grid)
+    if case.get("coincident"):
+        # The ground is first and the three large spheres last.
+        for sphere in world.objects[1:-3]:
+            sphere.center = p1.Vec3(2, 0.2, 1)
+    if case.get("bvh", True):
+        world = p1.BVH(world.objects)
+    cam = p1.default_camera(case["width"], case["height"])
+    start = time.perf_counter()
+    _, scheduler = p1.render_image(world, cam, case["width"], case["height"], case["spp"], case["max_depth"],
+                                   engine=case.get("engine", "vec3"), workers=case["workers"])
+    wall = time.perf_counter() - start
+    utilisation = sum(scheduler.busy.values()) / (scheduler.wall * case["workers"]) if scheduler.wall else 0.0
+    rays = case["width"] * case["height"] * case["spp"]
+    return rays, wall, {"sphere_count": len(world.objects), "worker_utilisation": utilisation}
+
+def run_assignment1(case):
+    a1 = load_script("assignment1")
+    spheres = [
+        a1.Sphere([0, -1, 3], 1, [255, 0, 0]),
+        a1.Sphere([2, 0, 4], 1, [0, 0, 255]),
+        a1.Sphere([-2, 0, 4], 1, [0, 255, 0]),
+    ]
+    spheres += [a1.Sphere(c, r, col) for c, r, col in extra_spheres(case["spheres"] - len(spheres))]
+    render = a1.render_vectorized if case.get("vectorized") else a1.render
+    start = time.perf_counter()
+    render(case["width"], case["height"], spheres)
+    return case["width"] * case["height"], time.perf_counter() - start, {"sphere_count": len(spheres)}
+
+def assignment_scene(module, case, reflective):
+    spheres = list(module.scene["spheres"])
+    for center, radius, color in extra_spheres(case["spheres"] - len(spheres)):
+        if reflective:
+            spheres.append(module.Sphere(center, radius, color, specular=100, reflective=0.3))
+        else:
+            spheres.append(module.Sphere(center, radius, color, specular=100))
+    return {"spheres": spheres, "lights": module.scene["lights"]}
+
+def run_assignment2(case):
+    a2 = load_script("assignment2")
+    scene = assignment_scene(a2, case, reflective=False)
+    render = a2.render_vectorized if case.get("vectorized") else a2.render
+    start = time.perf_counter()
+    render(scene, case["width"], case["height"], np.pi / 3)
+    return case["width"] * case["height"], time.perf_counter() - start, {"sphere_count": len(scene["spheres"])}
+
+def run_assignment3(case):
+    a3 = load_script("assignment3")
+    scene = assignment_scene(a3, case, reflective=True)
+    render = a3.render_vectorized if case.get("vectorized") else a3.render
+    start = time.perf_counter()
+    render(scene, case["width"], case["height"], np.pi / 3, case["max_depth"])
+    return case["width"] * case["height"], time.perf_counter() - start, {"sphere_count": len(scene["spheres"])}
+
+RUNNERS = {
+    "project1": run_project1,
+    "assignment1": run_assignment1,
+    "assignment2": run_assignment2,
+    "assignment3": run_assignment3,
+}
+
+def run_case(case):
+    """Render one case in this process and return its measurements."""
+    rays, wall, extra = RUNNERS[case["renderer"]](case)
+    # ru_maxrss is in kilobytes on Linux.
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    result = {"case": case, "key": case_key(case), "wall_time": wall, "rays": rays,
+              "rays_per_second": rays / wall if wall > 0 else 0.0,
+              "peak_rss_mb": self_rss, "peak_worker_rss_mb": child_rss}
+    result.update(extra)
+    return result
+
+def run_case_subprocess(case):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+#########################
+# Denoising Study
+#########################
+def image_error(image, reference):
+    """Mean squared error of two uint8 images, in [0, 1] units."""
+    return float(np.mean((image.astype(np.float64) / 255 - reference.astype(np.float64) / 255) ** 2))
+
+def equal_quality(error, plain):
+    """Interpolate (spp, wall time) at which plain rendering reaches error.
+
+    plain is a list of (spp, error, wall time) sorted by spp. Error and time
+    are interpolated log-linearly between the two plain renders that
+    bracket it. Returns (None, None) if no plain render is as good."""
+    for (s1, e1, t1), (s2, e2, t2) in zip(plain, plain[1:]):
+        if e1 >= error >= e2:
+            f = math.log(e1 / error) / math.log(e1 / e2) if e1 > e2 else 0.0
+            return s1 * (s2 / s1) ** f, t1 * (t2 / t1) ** f
+    if plain and error >= plain[0][1]:
+        return plain[0][0], plain[0][2]
+    return None, None
+
+def denoise_study(args):
+    p1 = load_script("project1")
+    width, height = parse_resolution(args.denoise_resolution)
+    base = BASE_CASES["project1"]
+    world = p1.random_scene(seed=0)
+    cam = p1.default_camera(width, height)
+    workers = max(parse_list(args.workers))
+
+    def render(spp, denoised, seed=0):
+        start = time.perf_counter()
+        image, _ = p1.render_image(world, cam, width, height, spp, base["max_depth"], engine="wavefront",
+                                   workers=workers, seed=seed, denoised=denoised)
+        return image, time.perf_counter() - start
+
+    # A different seed keeps the reference's noise independent of the test renders.
+    print(f"Rendering the {args.reference_spp} spp reference", file=sys.stderr)
+    reference, _ = render(args.reference_spp, False, seed=1)
+    plain = []
+    for spp in parse_list(args.plain_spp):
+        image, wall = render(spp, False)
+        plain.append((spp, image_error(image, reference), wall))
+        print(f"  plain {spp} spp: error {plain[-1][1]:.5f} in {wall:.2f}s", file=sys.stderr)
+    denoised = []
+    for spp in parse_list(args.denoise_spp):
+        image, wall = render(spp, True)
+        error = image_error(image, reference)
+        equal_spp, equal_time = equal_quality(error, plain)
+        denoised.append({"spp": spp, "error": error, "wall_time": wall, "equal_quality_spp": equal_spp,
+                         "equal_quality_speedup": equal_time / wall if equal_time else None})
+        print(f"  denoised {spp} spp: error {error:.5f} in {wall:.2f}s, like "
+              f"{equal_spp if equal_spp is None else round(equal_spp, 1)} plain spp", file=sys.stderr)
+    return {"resolution": [width, height], "reference_spp": args.reference_spp, "workers": workers,
+            "plain": [{"spp": spp, "error": error, "wall_time": wall} for spp, error, wall in plain],
+            "denoised": denoised}
+
+#########################
+# Sweeps
+#########################
+def case_key(case):
+    return " ".join(f"{k}={case[k]}" for k in sorted(case))
+
+def parse_list(text, convert=int):
+    return [convert(x) for x in text.split(",") if x]
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def build_cases(args):
+    """Base case plus one-parameter sweeps for each selected renderer, without duplicates."""
+    cases = []
+    seen = set()
+
+    def add(case):
+        key = case_key(case)
+        if key not in seen:
+            seen.add(key)
+            cases.append(case)
+
+    for renderer in parse_list(args.renderers, str):
+        if renderer == "project1":
+            variants = [{"engine": engine} for engine in parse_list(args.engines, str)]
+        elif renderer in VECTORIZED:
+            variants = [{}, {"vectorized": True}]
+        else:
+            variants = [{}]
+        for variant in variants:
+            base = dict(BASE_CASES[renderer], renderer=renderer, **variant)
+            add(base)
+            for spheres in parse_list(args.spheres):
+                add(dict(base, spheres=spheres))
+            for width, height in map(parse_resolution, parse_list(args.resolutions, str)):
+                add(dict(base, width=width, height=height))
+            if "spp" in base:
+                for spp in parse_list(args.spp):
+                    add(dict(base, spp=spp))
+            if "max_depth" in base:
+                for depth in parse_list(args.max_depth):
+                    add(dict(base, max_depth=depth))
+            if "workers" in base:
+                for workers in sorted(set(parse_list(args.workers)) | {1}):
+                    add(dict(base, workers=workers))
+            if variant.get("engine") == "vec3":
+                add(dict(base, coincident=True))
+    return cases
+
+def add_scaling_efficiency(results):
+    """Annotate project 1 results with speedup / workers relative to the matching one-worker case."""
+    single = {}
+    for r in results:
+        if "workers" in r["case"] and r["case"]["workers"] == 1:
+            single[case_key(dict(r["case"], workers=None))] = r["wall_time"]
+    for r in results:
+        if "workers" not in r["case"]:
+            continue
+        t1 = single.get(case_key(dict(r["case"], workers=None)))
+        if t1 is not None:
+            r["scaling_efficiency"] = t1 / r["wall_time"] / r["case"]["workers"]
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of regression descriptions (slower than baseline by more than tolerance)."""
+    previous = {r["key"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get(r["key"])
+        if old is None or old["rays_per_second"] <= 0:
+            continue
+        ratio = r["rays_per_second"] / old["rays_per_second"]
+        r["baseline_ratio"] = ratio
+        if ratio < 1.0 - tolerance:
+            regressions.append(f"{r['key']}: {r['rays_per_second']:.0f} rays/s vs "
+                               f"{old['rays_per_second']:.0f} baseline ({100 * (ratio - 1):+.1f}%)")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CPU ray tracers.")
+    parser.add_argument("--renderers", default=",".join(SCRIPTS), help="comma-separated subset of "
+                        + ", ".join(SCRIPTS))
+    parser.add_argument("--engines", default="vec3,wavefront", help="project 1 engines to run")
+    parser.add_argument("--spheres", default="50,2000", help="sphere counts to sweep")
+    parser.add_argument("--resolutions", default="40x20,160x80", help="WIDTHxHEIGHT values to sweep")
+    parser.add_argument("--spp", default="1,16", help="samples per pixel to sweep (project 1)")
+    parser.add_argument("--max-depth", default="1,50", help="max depths to sweep (project 1, assignment 3)")
+    parser.add_argument("--workers", default=str(os.cpu_count() or 1), help="worker counts to sweep (project 1)")
+    parser.add_argument("--denoise-study", action="store_true",
+                        help="compare denoised and plain project 1 renders at equal quality instead of sweeping")
+    parser.add_argument("--denoise-resolution", default="120x68", help="WIDTHxHEIGHT for the denoise study")
+    parser.add_argument("--denoise-spp", default="1,2,4", help="samples per pixel of the denoised renders")
+    parser.add_argument("--plain-spp", default="1,2,4,8,16,32", help="samples per pixel of the plain renders")
+    parser.add_argument("--reference-spp", type=int, default=256, help="samples per pixel of the reference")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="compare against this stored report")
+    parser.add_argument("--save-baseline", default=None, help="also store this run as a baseline here")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown before a case regresses")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+    if args.denoise_study:
+        text = json.dumps(denoise_study(args), indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text)
+        else:
+            print(text)
+        return 0
+
+    results = []
+    for case in build_cases(args):
+        print(f"Running {case_key(case)}", file=sys.stderr)
+        result = run_case_subprocess(case)
+        print(f"  {result['wall_time']:.2f}s, {result['rays_per_second']:.0f} rays/s, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB", file=sys.stderr)
+        results.append(result)
+    add_scaling_efficiency(results)
+
+    report = {"python": sys.version.split()[0], "cpu_count": os.cpu_count(), "results": results}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
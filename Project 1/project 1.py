@@ -1,19 +1,55 @@
 #!/usr/bin/env python3
+import argparse
+import collections
+import contextlib
+import functools
+import heapq
+import ipaddress
+import itertools
+import json
 import math
+import mmap
+import multiprocessing
+import os
+import queue
 import random
+import secrets
+import socket
+import struct
 import sys
+import tempfile
+import threading
+import time
+import zlib
 import concurrent.futures
+from multiprocessing import connection, resource_tracker, shared_memory
 import numpy as np
 from PIL import Image
 
 #########################
 # Utility Functions
 #########################
+# All randomness goes through these generators; seed_stream() reseeds them per key.
+RNG = random.Random()
+NP_RNG = np.random.default_rng()
+
+# First element of every stream key, so the streams never overlap.
+STREAM_SCENE = 0
+STREAM_PIXELS = 1
+STREAM_PROBE = 2
+STREAM_AOV = 3
+
+def seed_stream(master_seed, *key):
+    global NP_RNG
+    seq = np.random.SeedSequence((master_seed,) + key)
+    RNG.seed(int(seq.generate_state(1, np.uint64)[0]))
+    NP_RNG = np.random.default_rng(seq)
+
 def random_double():
-    return random.random()
+    return RNG.random()
 
 def random_double_range(min_val, max_val):
-    return random.uniform(min_val, max_val)
+    return RNG.uniform(min_val, max_val)
 
 def clamp(x, min_val, max_val):
     if x < min_val:
@@ -187,6 +223,10 @@ class Sphere(Hittable):
         rec.material = self.material
         return rec
 
+    def bounding_box(self):
+        r = Vec3(self.radius, self.radius, self.radius)
+        return AABB(self.center - r, self.center + r)
+
 class HittableList(Hittable):
     def __init__(self):
         self.objects = []
@@ -204,6 +244,174 @@ class HittableList(Hittable):
                 hit_anything = rec
         return hit_anything
 
+#########################
+# Bounding Volume Hierarchy
+#########################
+class AABB:
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def hit(self, ray, t_min, t_max):
+        # Slab test, one axis at a time so we can bail out early.
+        for o, d, lo, hi in ((ray.origin.x, ray.direction.x, self.minimum.x, self.maximum.x),
+                             (ray.origin.y, ray.direction.y, self.minimum.y, self.maximum.y),
+                             (ray.origin.z, ray.direction.z, self.minimum.z, self.maximum.z)):
+            if d == 0:
+                if o < lo or o > hi:
+                    return False
+                continue
+            inv_d = 1.0 / d
+            t0 = (lo - o) * inv_d
+            t1 = (hi - o) * inv_d
+            if inv_d < 0:
+                t0, t1 = t1, t0
+            if t0 > t_min:
+                t_min = t0
+            if t1 < t_max:
+                t_max = t1
+            if t_max <= t_min:
+                return False
+        return True
+
+    def area(self):
+        dx = self.maximum.x - self.minimum.x
+        dy = self.maximum.y - self.minimum.y
+        dz = self.maximum.z - self.minimum.z
+        return 2.0 * (dx * dy + dy * dz + dz * dx)
+
+def surrounding_box(box0, box1):
+    small = Vec3(min(box0.minimum.x, box1.minimum.x),
+                 min(box0.minimum.y, box1.minimum.y),
+                 min(box0.minimum.z, box1.minimum.z))
+    big = Vec3(max(box0.maximum.x, box1.maximum.x),
+               max(box0.maximum.y, box1.maximum.y),
+               max(box0.maximum.z, box1.maximum.z))
+    return AABB(small, big)
+
+def box_center(box, axis):
+    if axis == 0:
+        return box.minimum.x + box.maximum.x
+    if axis == 1:
+        return box.minimum.y + box.maximum.y
+    return box.minimum.z + box.maximum.z
+
+def sah_split(boxes):
+    """Return (index, cost) of the split of boxes (already sorted along an axis) with the lowest SAH cost."""
+    n = len(boxes)
+    left_areas = [0.0] * n
+    box = boxes[0]
+    for k in range(n):
+        box = surrounding_box(box, boxes[k])
+        left_areas[k] = box.area()
+    best_cost = float('inf')
+    best_split = n // 2
+    box = boxes[-1]
+    for k in range(n - 1, 0, -1):
+        box = surrounding_box(box, boxes[k])
+        # Left holds boxes[:k], right holds boxes[k:].
+        cost = left_areas[k - 1] * k + box.area() * (n - k)
+        if cost < best_cost:
+            best_cost = cost
+            best_split = k
+    return best_split, best_cost
+
+class BVHNode(Hittable):
+    """Binary BVH node. Splits along the widest centroid axis using the surface area heuristic,
+       or at the median when no split helps (e.g. coincident spheres)."""
+    def __init__(self, objects):
+        # An explicit stack, so that no scene can hit the recursion limit.
+        nodes = []
+        stack = [(self, objects)]
+        while stack:
+            node, objects = stack.pop()
+            nodes.append(node)
+            if len(objects) == 1:
+                node.left = node.right = objects[0]
+                continue
+            if len(objects) == 2:
+                node.left, node.right = objects
+                continue
+
+            boxes = [obj.bounding_box() for obj in objects]
+            spans = []
+            for axis in range(3):
+                centers = [box_center(box, axis) for box in boxes]
+                spans.append(max(centers) - min(centers))
+            axis = spans.index(max(spans))
+            order = sorted(range(len(objects)), key=lambda k: box_center(boxes[k], axis))
+            objects = [objects[k] for k in order]
+            boxes = [boxes[k] for k in order]
+
+            split, cost = sah_split(boxes)
+            box = boxes[0]
+            for b in boxes:
+                box = surrounding_box(box, b)
+            if spans[axis] == 0 or cost >= box.area() * len(objects):
+                split = len(objects) // 2
+            node.left = BVHNode.__new__(BVHNode)
+            node.right = BVHNode.__new__(BVHNode)
+            stack.append((node.right, objects[split:]))
+            stack.append((node.left, objects[:split]))
+        # Children come after their parent in nodes.
+        for node in reversed(nodes):
+            node.box = surrounding_box(node.left.bounding_box(), node.right.bounding_box())
+
+    def bounding_box(self):
+        return self.box
+
+    def refit(self):
+        """Recompute the boxes bottom-up after objects moved; the tree itself is kept."""
+        nodes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(child for child in (node.left, node.right) if isinstance(child, BVHNode))
+        for node in reversed(nodes):
+            node.box = surrounding_box(node.left.bounding_box(), node.right.bounding_box())
+
+    def hit(self, ray, t_min, t_max):
+        if not self.box.hit(ray, t_min, t_max):
+            return None
+        rec_left = self.left.hit(ray, t_min, t_max)
+        if self.right is self.left:
+            return rec_left
+        rec_right = self.right.hit(ray, t_min, rec_left.t if rec_left else t_max)
+        return rec_right if rec_right else rec_left
+
+class BVH(Hittable):
+    """Drop-in replacement for HittableList backed by a BVHNode tree, rebuilt on the first query after add()."""
+    def __init__(self, objects=()):
+        self.objects = list(objects)
+        self.build()
+
+    def add(self, obj):
+        self.objects.append(obj)
+        self.dirty = True
+
+    def build(self):
+        self.root = BVHNode(self.objects) if self.objects else None
+        self.dirty = False
+
+    def hit(self, ray, t_min, t_max):
+        if self.dirty:
+            self.build()
+        if self.root is None:
+            return None
+        return self.root.hit(ray, t_min, t_max)
+
+    def refit(self):
+        if self.dirty:
+            self.build()
+        elif self.root is not None:
+            self.root.refit()
+
+    def bounding_box(self):
+        if self.dirty:
+            self.build()
+        return self.root.bounding_box() if self.root is not None else None
+
 #########################
 # Materials
 #########################
@@ -285,31 +493,55 @@ class Camera:
 #########################
 # Ray Color Function
 #########################
-def ray_color(ray, world, depth):
-    if depth <= 0:
-        return Vec3(0, 0, 0)
-    rec = world.hit(ray, 0.001, float('inf'))
-    if rec:
+# Russian roulette starts after this many bounces unless told otherwise.
+RR_MIN_DEPTH = 5
+# Paths never survive roulette with a probability above this, so bright paths still end.
+RR_MAX_SURVIVAL = 0.95
+
+def ray_color(ray, world, depth, rr_min_depth=None):
+    """Follow a path of at most depth bounces and return its colour.
+       From bounce rr_min_depth on, Russian roulette may end it (None disables that)."""
+    stats = STATS
+    throughput = Vec3(1.0, 1.0, 1.0)
+    for bounce in range(depth):
+        if stats is not None:
+            stats.rays += 1
+            stats.bounces[bounce] += 1
+        rec = world.hit(ray, 0.001, float('inf'))
+        if not rec:
+            unit_direction = ray.direction.unit()
+            t = 0.5 * (unit_direction.y + 1.0)
+            return throughput * ((1.0 - t) * Vec3(1.0, 1.0, 1.0) + t * Vec3(0.5, 0.7, 1.0))
         scatter_success, scattered, attenuation = rec.material.scatter(ray, rec)
-        if scatter_success:
-            return attenuation * ray_color(scattered, world, depth - 1)
-        return Vec3(0, 0, 0)
-    unit_direction = ray.direction.unit()
-    t = 0.5 * (unit_direction.y + 1.0)
-    return (1.0 - t) * Vec3(1.0, 1.0, 1.0) + t * Vec3(0.5, 0.7, 1.0)
+        if not scatter_success:
+            return Vec3(0, 0, 0)
+        throughput = throughput * attenuation
+        if rr_min_depth is not None and bounce + 1 >= rr_min_depth:
+            p = min(max(throughput.x, throughput.y, throughput.z), RR_MAX_SURVIVAL)
+            if random_double() >= p:
+                if stats is not None:
+                    stats.roulette += 1
+                return Vec3(0, 0, 0)
+            throughput = throughput / p
+        ray = scattered
+    if stats is not None:
+        stats.depth_limit += 1
+    return Vec3(0, 0, 0)
 
 #########################
 # Scene Builder
 #########################
-def random_scene():
+def random_scene(use_bvh=True, seed=0, grid=11):
+    """Ground, three large spheres and up to (2 * grid)^2 small random spheres."""
+    seed_stream(seed, STREAM_SCENE)
     world = HittableList()
     # Ground
     ground_material = Lambertian(Vec3(0.5, 0.5, 0.5))
     world.add(Sphere(Vec3(0, -1000, 0), 1000, ground_material))
 
     # Many small spheres
-    for a in range(-11, 11):
-        for b in range(-11, 11):
+    for a in range(-grid, grid):
+        for b in range(-grid, grid):
             choose_mat = random_double()
             center = Vec3(a + 0.9 * random_double(), 0.2, b + 0.9 * random_double())
             if (center - Vec3(4, 0.2, 0)).length() > 0.9:
@@ -336,8 +568,853 @@ def random_scene():
     world.add(Sphere(Vec3(-4, 1, 0), 1.0, material2))
     material3 = Metal(Vec3(0.7, 0.6, 0.5), 0.0)    # Right ball (metal)
     world.add(Sphere(Vec3(4, 1, 0), 1.0, material3))
+    if use_bvh:
+        return BVH(world.objects)
     return world
 
+#########################
+# Wavefront (NumPy) Engine
+#########################
+# Traces whole batches of rays with NumPy arrays instead of one Vec3 ray at a time.
+MAT_LAMBERTIAN = 0
+MAT_METAL = 1
+MAT_DIELECTRIC = 2
+
+# Upper bound on rays x spheres evaluated in one intersection pass.
+WAVEFRONT_CHUNK_ELEMENTS = 1 << 21
+
+SKY_TOP = np.array([0.5, 0.7, 1.0])
+
+def vec3_to_array(v):
+    return np.array([v.x, v.y, v.z], dtype=np.float64)
+
+class SceneArrays:
+    """Flat arrays describing every sphere of a HittableList."""
+    def __init__(self, centers, radii, material_type, albedo, fuzz, ref_idx):
+        self.centers = centers
+        self.radii = radii
+        self.material_type = material_type
+        self.albedo = albedo
+        self.fuzz = fuzz
+        self.ref_idx = ref_idx
+
+    def __len__(self):
+        return len(self.radii)
+
+    @staticmethod
+    def from_world(world):
+        n = len(world.objects)
+        centers = np.zeros((n, 3))
+        radii = np.zeros(n)
+        material_type = np.zeros(n, dtype=np.int32)
+        albedo = np.ones((n, 3))
+        fuzz = np.zeros(n)
+        ref_idx = np.ones(n)
+        for k, sphere in enumerate(world.objects):
+            centers[k] = vec3_to_array(sphere.center)
+            radii[k] = sphere.radius
+            material = sphere.material
+            if isinstance(material, Lambertian):
+                material_type[k] = MAT_LAMBERTIAN
+                albedo[k] = vec3_to_array(material.albedo)
+            elif isinstance(material, Metal):
+                material_type[k] = MAT_METAL
+                albedo[k] = vec3_to_array(material.albedo)
+                fuzz[k] = material.fuzz
+            elif isinstance(material, Dielectric):
+                material_type[k] = MAT_DIELECTRIC
+                ref_idx[k] = material.ref_idx
+            else:
+                raise NotImplementedError(f"Wavefront engine does not support {type(material).__name__}")
+        return SceneArrays(centers, radii, material_type, albedo, fuzz, ref_idx)
+
+def dot_rows(u, v):
+    return np.einsum('ij,ij->i', u, v)
+
+def unit_rows(v):
+    return v / np.sqrt(dot_rows(v, v))[:, None]
+
+def reflect_rows(v, n):
+    return v - 2 * dot_rows(v, n)[:, None] * n
+
+def random_in_unit_sphere_rows(rng, count):
+    p = rng.uniform(-1, 1, (count, 3))
+    bad = np.flatnonzero(dot_rows(p, p) >= 1)
+    while len(bad):
+        p[bad] = rng.uniform(-1, 1, (len(bad), 3))
+        bad = bad[dot_rows(p[bad], p[bad]) >= 1]
+    return p
+
+def random_unit_vector_rows(rng, count):
+    a = rng.uniform(0, 2 * math.pi, count)
+    z = rng.uniform(-1, 1, count)
+    r = np.sqrt(1 - z * z)
+    return np.stack((r * np.cos(a), r * np.sin(a), z), axis=1)
+
+def random_in_unit_disk_rows(rng, count):
+    p = rng.uniform(-1, 1, (count, 2))
+    bad = np.flatnonzero(np.einsum('ij,ij->i', p, p) >= 1)
+    while len(bad):
+        p[bad] = rng.uniform(-1, 1, (len(bad), 2))
+        bad = bad[np.einsum('ij,ij->i', p[bad], p[bad]) >= 1]
+    return p
+
+def intersect_spheres(origins, directions, scene, t_min, t_max):
+    """Return (t, sphere index) of the nearest hit for every ray; index is -1 on a miss."""
+    n = len(origins)
+    best_t = np.full(n, t_max)
+    best_idx = np.full(n, -1, dtype=np.int64)
+    chunk = max(1, WAVEFRONT_CHUNK_ELEMENTS // max(1, len(scene)))
+    r2 = scene.radii * scene.radii
+    for start in range(0, n, chunk):
+        o = origins[start:start + chunk]
+        d = directions[start:start + chunk]
+        a = dot_rows(d, d)[:, None]
+        oc = o[:, None, :] - scene.centers[None, :, :]
+        half_b = np.einsum('rsk,rk->rs', oc, d)
+        c = np.einsum('rsk,rsk->rs', oc, oc) - r2[None, :]
+        discriminant = half_b * half_b - a * c
+        with np.errstate(invalid='ignore'):
+            sqrtd = np.sqrt(discriminant)
+        root = (-half_b - sqrtd) / a
+        far = (-half_b + sqrtd) / a
+        root = np.where((root < t_min) | (root > t_max), far, root)
+        root = np.where((discriminant < 0) | (root < t_min) | (root > t_max), np.inf, root)
+        idx = np.argmin(root, axis=1)
+        t = root[np.arange(len(idx)), idx]
+        found = np.isfinite(t)
+        best_t[start:start + chunk][found] = t[found]
+        best_idx[start:start + chunk][found] = idx[found]
+    return best_t, best_idx
+
+def scatter_rows(directions, normals, front_face, idx, scene, rng):
+    """Scatter a batch of hits by material; return (directions, attenuation, scattered mask)."""
+    n = len(directions)
+    new_dir = np.empty((n, 3))
+    attenuation = np.ones((n, 3))
+    scattered = np.ones(n, dtype=bool)
+    mat = scene.material_type[idx]
+
+    sel = np.flatnonzero(mat == MAT_LAMBERTIAN)
+    if len(sel):
+        nrm = normals[sel]
+        d = nrm + random_unit_vector_rows(rng, len(sel))
+        near_zero = np.all(np.abs(d) < 1e-8, axis=1)
+        d[near_zero] = nrm[near_zero]
+        new_dir[sel] = d
+        attenuation[sel] = scene.albedo[idx[sel]]
+
+    sel = np.flatnonzero(mat == MAT_METAL)
+    if len(sel):
+        nrm = normals[sel]
+        reflected = reflect_rows(unit_rows(directions[sel]), nrm)
+        d = reflected + scene.fuzz[idx[sel]][:, None] * random_in_unit_sphere_rows(rng, len(sel))
+        new_dir[sel] = d
+        attenuation[sel] = scene.albedo[idx[sel]]
+        scattered[sel] = dot_rows(d, nrm) > 0
+
+    sel = np.flatnonzero(mat == MAT_DIELECTRIC)
+    if len(sel):
+        nrm = normals[sel]
+        ref_idx = scene.ref_idx[idx[sel]]
+        ratio = np.where(front_face[sel], 1.0 / ref_idx, ref_idx)
+        unit_direction = unit_rows(directions[sel])
+        cos_theta = np.minimum(-dot_rows(unit_direction, nrm), 1.0)
+        sin_theta = np.sqrt(1.0 - cos_theta * cos_theta)
+        r0 = ((1 - ratio) / (1 + ratio)) ** 2
+        reflectance = r0 + (1 - r0) * (1 - cos_theta) ** 5
+        reflect_mask = (ratio * sin_theta > 1.0) | (reflectance > rng.random(len(sel)))
+        r_out_parallel = ratio[:, None] * (unit_direction + cos_theta[:, None] * nrm)
+        perp_len = np.sqrt(np.abs(1.0 - dot_rows(r_out_parallel, r_out_parallel)))
+        refracted = r_out_parallel - perp_len[:, None] * nrm
+        new_dir[sel] = np.where(reflect_mask[:, None], reflect_rows(unit_direction, nrm), refracted)
+
+    return new_dir, attenuation, scattered
+
+def wavefront_ray_color(origins, directions, scene, max_depth, rng, rr_min_depth=None):
+    """Trace a batch of rays; the array equivalent of ray_color, Russian roulette included."""
+    stats = STATS
+    color = np.zeros((len(origins), 3))
+    alive = np.arange(len(origins))
+    throughput = np.ones((len(origins), 3))
+    o = origins
+    d = directions
+    for bounce in range(max_depth):
+        if len(alive) == 0:
+            break
+        t, idx = intersect_spheres(o, d, scene, 0.001, float('inf'))
+
+        miss = idx < 0
+        if stats is not None:
+            stats.rays += len(alive)
+            stats.world_queries += len(alive)
+            stats.bounces[bounce] += len(alive)
+            stats.intersection_tests += len(alive) * len(scene)
+            stats.hits += int(len(alive) - miss.sum())
+            stats.escaped += int(miss.sum())
+        if miss.any():
+            unit_direction = unit_rows(d[miss])
+            sky_t = 0.5 * (unit_direction[:, 1] + 1.0)
+            sky = (1.0 - sky_t)[:, None] + sky_t[:, None] * SKY_TOP
+            color[alive[miss]] = throughput[miss] * sky
+
+        hit = ~miss
+        alive, o, d, t, idx, throughput = alive[hit], o[hit], d[hit], t[hit], idx[hit], throughput[hit]
+        p = o + t[:, None] * d
+        outward_normal = (p - scene.centers[idx]) / scene.radii[idx][:, None]
+        front_face = dot_rows(d, outward_normal) < 0
+        normals = np.where(front_face[:, None], outward_normal, -outward_normal)
+
+        new_dir, attenuation, scattered = scatter_rows(d, normals, front_face, idx, scene, rng)
+        if stats is not None:
+            mat = scene.material_type[idx]
+            for mat_id, name in enumerate(MATERIAL_NAMES):
+                stats.scatters[name] += int(np.count_nonzero(scattered & (mat == mat_id)))
+                stats.absorbed[name] += int(np.count_nonzero(~scattered & (mat == mat_id)))
+        alive = alive[scattered]
+        o = p[scattered]
+        d = new_dir[scattered]
+        throughput = throughput[scattered] * attenuation[scattered]
+        if rr_min_depth is not None and bounce + 1 >= rr_min_depth:
+            survival = np.minimum(throughput.max(axis=1), RR_MAX_SURVIVAL)
+            survive = rng.random(len(alive)) < survival
+            if stats is not None:
+                stats.roulette += int(len(alive) - survive.sum())
+            alive, o, d = alive[survive], o[survive], d[survive]
+            throughput = throughput[survive] / survival[survive][:, None]
+    if stats is not None:
+        stats.depth_limit += len(alive)
+    return color
+
+def first_hit_aovs(origins, directions, scene):
+    """Albedo, normal and distance of the first hit along each ray (sky colour, 0, 0 on a miss)."""
+    n = len(origins)
+    t, idx = intersect_spheres(origins, directions, scene, 0.001, float('inf'))
+    hit = idx >= 0
+    unit_direction = unit_rows(directions)
+    sky_t = 0.5 * (unit_direction[:, 1] + 1.0)
+    albedo = (1.0 - sky_t)[:, None] + sky_t[:, None] * SKY_TOP
+    albedo[hit] = scene.albedo[idx[hit]]
+    normal = np.zeros((n, 3))
+    p = origins[hit] + t[hit][:, None] * directions[hit]
+    outward_normal = (p - scene.centers[idx[hit]]) / scene.radii[idx[hit]][:, None]
+    front_face = dot_rows(directions[hit], outward_normal) < 0
+    normal[hit] = np.where(front_face[:, None], outward_normal, -outward_normal)
+    depth = np.zeros(n)
+    depth[hit] = t[hit] * np.sqrt(dot_rows(directions[hit], directions[hit]))
+    return albedo, normal, depth
+
+def camera_rays(cam, s, t, rng):
+    """Vectorised Camera.get_ray for arrays of viewport coordinates s and t."""
+    origin = vec3_to_array(cam.origin)
+    directions = (vec3_to_array(cam.lower_left_corner) - origin
+                  + s[:, None] * vec3_to_array(cam.horizontal)
+                  + t[:, None] * vec3_to_array(cam.vertical))
+    # Like Camera.get_ray, the lens offset only perturbs the direction.
+    if cam.lens_radius > 0:
+        rd = cam.lens_radius * random_in_unit_disk_rows(rng, len(s))
+        directions -= rd[:, :1] * vec3_to_array(cam.u) + rd[:, 1:] * vec3_to_array(cam.v)
+    origins = np.broadcast_to(origin, directions.shape).copy()
+    return origins, directions
+
+#########################
+# Binary Scene File
+#########################
+# The world reaches the workers as a file of flat arrays that each one maps read-only.
+class SceneFile:
+    """Memory-mapped SceneArrays: a MAGIC/count/flags header, then FIELDS in order."""
+    MAGIC = b"RTSCENE1"
+    HEADER = np.dtype([("magic", "S8"), ("count", "<u8"), ("flags", "<u8")])
+    FLAG_BVH = 1
+    # (SceneArrays attribute, dtype, values per sphere)
+    FIELDS = (("centers", "<f8", 3), ("radii", "<f8", 1), ("albedo", "<f8", 3),
+              ("fuzz", "<f8", 1), ("ref_idx", "<f8", 1), ("material_type", "<i4", 1))
+
+    def __init__(self, arrays, flags, mm=None):
+        self.arrays = arrays
+        self.flags = flags
+        self.mm = mm
+        self._world = None
+
+    @staticmethod
+    def pack(world):
+        """The scene file contents for world (a HittableList or BVH of spheres)."""
+        arrays = SceneArrays.from_world(world)
+        flags = SceneFile.FLAG_BVH if isinstance(world, BVH) else 0
+        parts = [np.array((SceneFile.MAGIC, len(arrays), flags), dtype=SceneFile.HEADER).tobytes()]
+        for name, dtype, _ in SceneFile.FIELDS:
+            parts.append(np.ascontiguousarray(getattr(arrays, name), dtype=dtype).tobytes())
+        return b"".join(parts)
+
+    @staticmethod
+    def write(path, world=None, data=None):
+        """Write a scene file for world, or the already packed data, to path."""
+        with open(path, "wb") as f:
+            f.write(SceneFile.pack(world) if data is None else data)
+
+    @staticmethod
+    def open(path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.ndarray((), dtype=SceneFile.HEADER, buffer=mm)
+        if header["magic"] != SceneFile.MAGIC:
+            mm.close()
+            raise ValueError(f"{path} is not a scene file")
+        count = int(header["count"])
+        offset = SceneFile.HEADER.itemsize
+        fields = {}
+        for name, dtype, width in SceneFile.FIELDS:
+            shape = (count, width) if width > 1 else (count,)
+            fields[name] = np.ndarray(shape, dtype=dtype, buffer=mm, offset=offset)
+            offset += fields[name].nbytes
+        return SceneFile(SceneArrays(**fields), int(header["flags"]), mm)
+
+    @property
+    def world(self):
+        """The scene as Sphere objects (in a BVH if it was written from one), built when first asked for."""
+        if self._world is None:
+            a = self.arrays
+            world = HittableList()
+            for center, radius, mat, albedo, fuzz, ref_idx in zip(a.centers.tolist(), a.radii.tolist(),
+                                                                  a.material_type.tolist(), a.albedo.tolist(),
+                                                                  a.fuzz.tolist(), a.ref_idx.tolist()):
+                if mat == MAT_LAMBERTIAN:
+                    material = Lambertian(Vec3(*albedo))
+                elif mat == MAT_METAL:
+                    material = Metal(Vec3(*albedo), fuzz)
+                else:
+                    material = Dielectric(ref_idx)
+                world.add(Sphere(Vec3(*center), radius, material))
+            self._world = BVH(world.objects) if self.flags & self.FLAG_BVH else world
+        return self._world
+
+@contextlib.contextmanager
+def temporary_scene_file(world):
+    """Write world to a temporary scene file, yield its path and delete it afterwards."""
+    fd, scene_path = tempfile.mkstemp(suffix=".scene")
+    os.close(fd)
+    try:
+        SceneFile.write(scene_path, world)
+        yield scene_path
+    finally:
+        os.remove(scene_path)
+
+#########################
+# Instrumentation
+#########################
+# STATS is None unless enable_stats() swapped in the counting methods.
+STATS = None
+
+MATERIAL_NAMES = ("Lambertian", "Metal", "Dielectric")
+
+class RenderStats:
+    """Hot-path counters for one process."""
+    COUNTERS = ("rays", "world_queries", "intersection_tests", "hits", "bvh_node_tests", "escaped", "depth_limit",
+                "roulette")
+
+    def __init__(self, max_depth):
+        self.max_depth = max_depth
+        self.reset()
+
+    def reset(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.scatters = collections.Counter()
+        self.absorbed = collections.Counter()
+        # bounces[k] counts rays traced as the k-th segment of their path.
+        self.bounces = [0] * self.max_depth
+
+    def take(self):
+        """Return the counters as a plain dict and start again from zero."""
+        snapshot = {name: getattr(self, name) for name in self.COUNTERS}
+        snapshot["scatters"] = dict(self.scatters)
+        snapshot["absorbed"] = dict(self.absorbed)
+        snapshot["bounces"] = list(self.bounces)
+        self.reset()
+        return snapshot
+
+def merge_stats(total, delta):
+    """Add a RenderStats.take() snapshot into total (a dict of the same shape) in place."""
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            counter = total.setdefault(key, {})
+            for name, count in value.items():
+                counter[name] = counter.get(name, 0) + count
+        elif isinstance(value, list):
+            bins = total.setdefault(key, [])
+            bins.extend([0] * (len(value) - len(bins)))
+            for k, count in enumerate(value):
+                bins[k] += count
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+def enable_stats(max_depth):
+    """Start counting in this process by wrapping the hit and scatter methods."""
+    global STATS
+    if STATS is not None:
+        return
+    STATS = stats = RenderStats(max_depth)
+
+    sphere_hit = Sphere.hit
+    def counted_sphere_hit(self, ray, t_min, t_max):
+        stats.intersection_tests += 1
+        return sphere_hit(self, ray, t_min, t_max)
+    Sphere.hit = counted_sphere_hit
+
+    box_hit = AABB.hit
+    def counted_box_hit(self, ray, t_min, t_max):
+        stats.bvh_node_tests += 1
+        return box_hit(self, ray, t_min, t_max)
+    AABB.hit = counted_box_hit
+
+    for world_cls in (HittableList, BVH):
+        def counted_world_hit(self, ray, t_min, t_max, world_hit=world_cls.hit):
+            stats.world_queries += 1
+            rec = world_hit(self, ray, t_min, t_max)
+            if rec is None:
+                stats.escaped += 1
+            else:
+                stats.hits += 1
+            return rec
+        world_cls.hit = counted_world_hit
+
+    for material_cls in (Lambertian, Metal, Dielectric):
+        def counted_scatter(self, ray_in, hit_record, scatter=material_cls.scatter, name=material_cls.__name__):
+            result = scatter(self, ray_in, hit_record)
+            if result[0]:
+                stats.scatters[name] += 1
+            else:
+                stats.absorbed[name] += 1
+            return result
+        material_cls.scatter = counted_scatter
+
+def stats_summary(totals, wall_time, per_worker=None):
+    """Machine-readable summary of merged counters, with a few derived rates."""
+    summary = {"wall_time": wall_time, "totals": totals}
+    rays = totals.get("rays", 0)
+    if rays:
+        summary["rays_per_second"] = rays / wall_time if wall_time > 0 else 0.0
+        summary["intersection_tests_per_ray"] = totals.get("intersection_tests", 0) / rays
+        summary["bvh_node_tests_per_ray"] = totals.get("bvh_node_tests", 0) / rays
+        paths = totals.get("bounces", [0])[0]
+        summary["mean_path_length"] = rays / paths if paths else 0.0
+    if per_worker is not None:
+        summary["workers"] = {str(pid): counters for pid, counters in per_worker.items()}
+    return summary
+
+#########################
+# Shared Frame Buffer
+#########################
+class FrameBuffer:
+    """float32 (height, width, 4) buffer of colour sums and sample counts, shared between processes.
+       Row 0 is the bottom scanline. spec identifies it for attach()."""
+    CHANNELS = 4
+
+    def __init__(self, width, height, buffer, shm=None, mm=None, path=None, channels=CHANNELS):
+        self.width = width
+        self.height = height
+        self.shm = shm
+        self.mm = mm
+        self.path = path
+        self.pixels = np.ndarray((height, width, channels), dtype=np.float32, buffer=buffer)
+
+    @property
+    def spec(self):
+        if self.shm is not None:
+            return ("shm", self.shm.name)
+        if self.mm is not None:
+            return ("file", self.path)
+        return ("memory", None)
+
+    @staticmethod
+    def nbytes(width, height, channels=CHANNELS):
+        return width * height * channels * np.dtype(np.float32).itemsize
+
+    @staticmethod
+    def create(width, height, channels=CHANNELS):
+        shm = shared_memory.SharedMemory(create=True, size=FrameBuffer.nbytes(width, height, channels))
+        fb = FrameBuffer(width, height, shm.buf, shm=shm, channels=channels)
+        fb.pixels.fill(0.0)
+        return fb
+
+    @staticmethod
+    def open_file(path, width, height):
+        """Map the accumulation file at path, creating a zero-filled one if it does not exist."""
+        size = FrameBuffer.nbytes(width, height)
+        with open(path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size != size:
+                f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+        return FrameBuffer(width, height, mm, mm=mm, path=path)
+
+    @staticmethod
+    def attach(spec, width, height, channels=CHANNELS):
+        kind, location = spec
+        if kind == "shm":
+            shm = FrameBuffer.attach_shm(location)
+            return FrameBuffer(width, height, shm.buf, shm=shm, channels=channels)
+        if kind == "memory":
+            return FrameBuffer(width, height, bytearray(FrameBuffer.nbytes(width, height, channels)),
+                               channels=channels)
+        return FrameBuffer.open_file(location, width, height)
+
+    @staticmethod
+    def attach_shm(name):
+        """Open the block without registering it with the resource tracker; only its creator unlinks it."""
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+    def flush_rows(self, y0, y1):
+        """Write scanlines [y0, y1) of a file-backed buffer to disk."""
+        if self.mm is None:
+            return
+        row_bytes = self.width * self.CHANNELS * self.pixels.itemsize
+        start = (y0 * row_bytes) // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+        self.mm.flush(start, y1 * row_bytes - start)
+
+    def add(self, x0, y0, colors, samples):
+        """Accumulate colour sums (h, w, 3) and sample counts for the block starting at pixel (x0, y0)."""
+        h, w = colors.shape[:2]
+        block = self.pixels[y0:y0 + h, x0:x0 + w]
+        # Count first: a block interrupted mid-write then always shows a
+        # sample count that disagrees with the checkpoint manifest.
+        block[..., 3] += samples
+        block[..., :3] += colors
+
+    def add_block(self, x0, y0, block):
+        """Accumulate a (h, w, 4) block of colour sums and sample counts taken from another buffer."""
+        h, w = block.shape[:2]
+        target = self.pixels[y0:y0 + h, x0:x0 + w]
+        target[..., 3] += block[..., 3]
+        target[..., :3] += block[..., :3]
+
+    def take_block(self, x0, y0, width, height):
+        """Return a copy of a block of the buffer and zero it."""
+        target = self.pixels[y0:y0 + height, x0:x0 + width]
+        block = target.copy()
+        target.fill(0.0)
+        return block
+
+    def mean_colors(self):
+        """Average colour of every pixel, (height, width, 3) with row 0 at the bottom."""
+        return self.pixels[..., :3] / np.maximum(self.pixels[..., 3:], 1.0)
+
+    def tone_map(self, colors=None):
+        """Gamma-correct (gamma 2) and quantise the averaged buffer, or colors laid out like
+        mean_colors(), into a top-row-first uint8 image."""
+        return self.tone_map_rows(0, self.height, colors)
+
+    def tone_map_rows(self, top, bottom, colors=None):
+        """tone_map() of image rows [top, bottom) only, counted from the top of the image."""
+        lo, hi = self.height - bottom, self.height - top
+        if colors is None:
+            pixels = self.pixels[lo:hi]
+            colors = pixels[..., :3] / np.maximum(pixels[..., 3:], 1.0)
+        else:
+            colors = colors[lo:hi]
+        return (256 * np.clip(np.sqrt(colors[::-1]), 0.0, 0.999)).astype(np.uint8)
+
+    def sample_heatmap(self):
+        """Top-row-first RGB image of the per-pixel sample counts (black = fewest, yellow = most)."""
+        samples = self.pixels[::-1, :, 3]
+        lo = samples.min()
+        t = (samples - lo) / max(samples.max() - lo, 1.0)
+        heat = np.stack((np.clip(3 * t, 0, 1), np.clip(3 * t - 1, 0, 1), np.clip(3 * t - 2, 0, 1)), axis=-1)
+        return (255 * heat).astype(np.uint8)
+
+    def close(self):
+        # Drop our view before closing, otherwise the mapping is still exported.
+        self.pixels = None
+        if self.shm is not None:
+            self.shm.close()
+        elif self.mm is not None:
+            self.mm.close()
+
+    def unlink(self):
+        if self.shm is not None:
+            self.shm.unlink()
+
+#########################
+# Denoising
+#########################
+# With --denoise the workers also fill an AOV buffer (first-hit albedo, normal
+# and depth) that guides atrous_denoise().
+AOV_CHANNELS = 7  # albedo (3), normal (3), depth (1)
+AOV_SAMPLES = 4
+ATROUS_KERNEL = np.array([1.0, 4.0, 6.0, 4.0, 1.0]) / 16.0
+
+def box_variance(values, radius=2):
+    """Variance of values (h, w) over the (2 * radius + 1)^2 window around each pixel."""
+    h, w = values.shape
+    size = 2 * radius + 1
+    padded = np.pad(values, radius, mode="edge")
+    total = np.zeros_like(values)
+    total_sq = np.zeros_like(values)
+    for dy in range(size):
+        for dx in range(size):
+            window = padded[dy:dy + h, dx:dx + w]
+            total += window
+            total_sq += window * window
+    mean = total / (size * size)
+    return np.maximum(total_sq / (size * size) - mean * mean, 0.0)
+
+def atrous_denoise(color, albedo, normal, depth, iterations=3, sigma_luminance=2.0, sigma_normal=1.0,
+                   sigma_albedo=0.6, sigma_depth=0.3):
+    """Edge-avoiding a-trous filter of color (h, w, 3) guided by albedo, normal, depth and a noise estimate."""
+    albedo = np.maximum(albedo.astype(np.float64), 1e-3)
+    normal = normal.astype(np.float64)
+    depth = depth.astype(np.float64)
+    irradiance = color.astype(np.float64) / albedo
+    variance = box_variance(irradiance @ LUMINANCE_WEIGHTS)
+    h, w = depth.shape
+    depth_scale = sigma_depth * np.maximum(depth, 1e-3)
+    for level in range(iterations):
+        step = 1 << level
+        pad = 2 * step
+
+        def shifted(values, dy, dx):
+            padded = np.pad(values, [(pad, pad), (pad, pad)] + [(0, 0)] * (values.ndim - 2), mode="edge")
+            return padded[pad + dy * step:pad + dy * step + h, pad + dx * step:pad + dx * step + w]
+
+        luminance = irradiance @ LUMINANCE_WEIGHTS
+        luminance_scale = sigma_luminance * np.sqrt(variance) + 1e-4
+        total = np.zeros_like(irradiance)
+        weights = np.zeros((h, w))
+        filtered_variance = np.zeros((h, w))
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                q_irradiance = shifted(irradiance, dy, dx)
+                exponent = (np.abs(luminance - q_irradiance @ LUMINANCE_WEIGHTS) / luminance_scale
+                            + np.sum((normal - shifted(normal, dy, dx)) ** 2, axis=-1) / (sigma_normal ** 2)
+                            + np.sum((albedo - shifted(albedo, dy, dx)) ** 2, axis=-1) / (sigma_albedo ** 2)
+                            + np.abs(depth - shifted(depth, dy, dx)) / depth_scale)
+                weight = ATROUS_KERNEL[dy + 2] * ATROUS_KERNEL[dx + 2] * np.exp(-exponent)
+                total += weight[..., None] * q_irradiance
+                weights += weight
+                filtered_variance += weight * weight * shifted(variance, dy, dx)
+        irradiance = total / weights[..., None]
+        variance = filtered_variance / (weights * weights)
+    return irradiance * albedo
+
+def denoise(framebuffer, aov_buffer):
+    """Denoised mean colours of framebuffer, laid out like FrameBuffer.mean_colors()."""
+    aovs = aov_buffer.pixels
+    return atrous_denoise(framebuffer.mean_colors(), aovs[..., 0:3], aovs[..., 3:6], aovs[..., 6])
+
+#########################
+# Checkpoints
+#########################
+def block_sums(values):
+    """Sum a (height, width) array over MIN_TILE_SIZE blocks whose origin is at (0, 0)."""
+    values = values.astype(np.float64)
+    values = np.add.reduceat(values, np.arange(0, values.shape[0], MIN_TILE_SIZE), axis=0)
+    return np.add.reduceat(values, np.arange(0, values.shape[1], MIN_TILE_SIZE), axis=1)
+
+class Checkpoint:
+    """Resumable render state in a directory: the buffer, per-block sample levels and a settings manifest."""
+    MANIFEST = "manifest.json"
+    ACCUM = "accum.f32"
+    BLOCKS = "blocks.npy"
+    # Settings that must match to resume; anything else may change between runs.
+    KEYS = ("width", "height", "seed", "max_depth", "engine", "adaptive", "min_spp", "rr_min_depth")
+
+    def __init__(self, directory, settings):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, self.MANIFEST)
+        blocks_path = os.path.join(directory, self.BLOCKS)
+        width, height = settings["width"], settings["height"]
+        blocks_shape = (-(-height // MIN_TILE_SIZE), -(-width // MIN_TILE_SIZE), 2)
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            for key in self.KEYS:
+                if manifest.get(key) != settings[key]:
+                    raise ValueError(f"Checkpoint {directory} was rendered with {key}={manifest.get(key)}, "
+                                     f"not {settings[key]}")
+            self.blocks = np.load(blocks_path, mmap_mode="r+")
+        else:
+            self.blocks = np.lib.format.open_memmap(blocks_path, mode="w+", dtype=np.int64, shape=blocks_shape)
+            with open(manifest_path, "w") as f:
+                json.dump({key: settings[key] for key in self.KEYS}, f, indent=2)
+        self.framebuffer = FrameBuffer.open_file(os.path.join(directory, self.ACCUM), width, height)
+        self.repaired = self.repair()
+
+    def repair(self):
+        """Reset blocks whose accumulated samples do not match the manifest; return how many."""
+        broken = np.argwhere(block_sums(self.framebuffer.pixels[..., 3]) != self.blocks[..., 1])
+        for by, bx in broken:
+            y0, x0 = by * MIN_TILE_SIZE, bx * MIN_TILE_SIZE
+            self.framebuffer.pixels[y0:y0 + MIN_TILE_SIZE, x0:x0 + MIN_TILE_SIZE] = 0.0
+            self.blocks[by, bx] = 0
+        if len(broken):
+            self.framebuffer.flush_rows(0, self.framebuffer.height)
+            self.blocks.flush()
+        return len(broken)
+
+    def levels(self):
+        return self.blocks[..., 0]
+
+    def record(self, tile):
+        """Mark the blocks of a finished tile as rendered up to tile.sample_start + tile.samples."""
+        self.framebuffer.flush_rows(tile.y0, tile.y0 + tile.height)
+        by0, by1 = tile.y0 // MIN_TILE_SIZE, -(-(tile.y0 + tile.height) // MIN_TILE_SIZE)
+        bx0, bx1 = tile.x0 // MIN_TILE_SIZE, -(-(tile.x0 + tile.width) // MIN_TILE_SIZE)
+        totals = block_sums(self.framebuffer.pixels[tile.y0:tile.y0 + tile.height, tile.x0:tile.x0 + tile.width, 3])
+        self.blocks[by0:by1, bx0:bx1, 0] = tile.sample_start + tile.samples
+        self.blocks[by0:by1, bx0:bx1, 1] = totals
+        self.blocks.flush()
+
+    def close(self):
+        self.framebuffer.close()
+        del self.blocks
+
+#########################
+# Image Output
+#########################
+# Images are written STREAM_ROWS rows at a time, top row first.
+STREAM_ROWS = 16
+
+class PPMWriter:
+    """Binary (P6) PPM writer."""
+    def __init__(self, f, width, height):
+        self.f = f
+        f.write(b"P6\n%d %d\n255\n" % (width, height))
+
+    def write_rows(self, rows):
+        self.f.write(rows.tobytes())
+
+    def close(self):
+        pass
+
+class PNGWriter:
+    """8-bit RGB PNG writer; each row gets the filter with the smallest sum of absolute residuals, as libpng does."""
+    IDAT_SIZE = 1 << 16
+
+    def __init__(self, f, width, height):
+        self.f = f
+        self.compressor = zlib.compressobj()
+        self.pending = bytearray()
+        self.previous = np.zeros(width * 3, dtype=np.uint8)
+        f.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def chunk(self, kind, data):
+        self.f.write(struct.pack(">I", len(data)) + kind + data)
+        self.f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    @staticmethod
+    def filter_rows(rows, previous):
+        """Prefix every row of rows (n, stride) with its best filter type byte and residuals."""
+        x = rows.astype(np.int16)
+        up = np.concatenate((previous[None], rows[:-1])).astype(np.int16)
+        left = np.zeros_like(x)
+        left[:, 3:] = x[:, :-3]
+        up_left = np.zeros_like(x)
+        up_left[:, 3:] = up[:, :-3]
+        # Paeth predictor: whichever neighbour is closest to left + up - up_left.
+        pa = np.abs(up - up_left)
+        pb = np.abs(left - up_left)
+        pc = np.abs(left + up - 2 * up_left)
+        paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+        candidates = np.stack((x, x - left, x - up, x - (left + up) // 2, x - paeth)).astype(np.uint8)
+        # Residuals are scored as signed bytes.
+        scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+        best = scores.argmin(axis=0)
+        filtered = candidates[best, np.arange(len(rows))]
+        return np.concatenate((best.astype(np.uint8)[:, None], filtered), axis=1)
+
+    def write_rows(self, rows):
+        rows = rows.reshape(len(rows), -1)
+        self.pending += self.compressor.compress(self.filter_rows(rows, self.previous).tobytes())
+        self.previous = rows[-1].copy()
+        if len(self.pending) >= self.IDAT_SIZE:
+            self.chunk(b"IDAT", bytes(self.pending))
+            self.pending.clear()
+
+    def close(self):
+        self.pending += self.compressor.flush()
+        self.chunk(b"IDAT", bytes(self.pending))
+        self.chunk(b"IEND", b"")
+
+class PillowWriter:
+    """Collects the rows for formats without a streaming encoder and saves them with Pillow."""
+    def __init__(self, f, width, height, format):
+        self.f = f
+        self.format = format
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+        self.row = 0
+
+    def write_rows(self, rows):
+        self.image[self.row:self.row + len(rows)] = rows
+        self.row += len(rows)
+
+    def close(self):
+        Image.fromarray(self.image, 'RGB').save(self.f, format=self.format)
+
+IMAGE_WRITERS = {".png": PNGWriter, ".ppm": PPMWriter}
+
+class ImageStream:
+    """Writes a FrameBuffer to path as its rows complete; call tile_done() for each finished tile."""
+    def __init__(self, path, framebuffer, tiles=None):
+        self.path = path
+        self.framebuffer = framebuffer
+        self.missing = np.zeros(framebuffer.height, dtype=np.int64)
+        if tiles is None:
+            self.missing += framebuffer.width
+        for tile in tiles or ():
+            self.missing[tile.y0:tile.y0 + tile.height] += tile.width
+        self.row = 0
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in IMAGE_WRITERS and extension not in Image.registered_extensions():
+            raise ValueError(f"Unknown image format for {path}")
+        self.f = open(path + ".part", "wb")
+        if extension in IMAGE_WRITERS:
+            self.writer = IMAGE_WRITERS[extension](self.f, framebuffer.width, framebuffer.height)
+        else:
+            self.writer = PillowWriter(self.f, framebuffer.width, framebuffer.height,
+                                       Image.registered_extensions()[extension])
+        self.flush()
+
+    def flush(self, colors=None, end=None):
+        """Write rows up to end (default: up to the first incomplete one), STREAM_ROWS at a time."""
+        height = self.framebuffer.height
+        if end is None:
+            # Scanlines above the last written row, nearest first.
+            incomplete = np.flatnonzero(self.missing[:height - self.row][::-1])
+            end = self.row + incomplete[0] if len(incomplete) else height
+        for top in range(self.row, end, STREAM_ROWS):
+            self.writer.write_rows(self.framebuffer.tone_map_rows(top, min(top + STREAM_ROWS, end), colors))
+        self.row = max(self.row, end)
+
+    def tile_done(self, tile):
+        self.missing[tile.y0:tile.y0 + tile.height] -= tile.width
+        self.flush()
+
+    def finish(self, colors=None):
+        """Write the remaining rows (from colors, laid out like mean_colors(), if given) and move the file into place."""
+        self.flush(colors, self.framebuffer.height)
+        self.writer.close()
+        self.f.close()
+        os.replace(self.path + ".part", self.path)
+
+    def abort(self):
+        """Drop a partly written image; does nothing after finish()."""
+        if not self.f.closed:
+            self.f.close()
+            os.remove(self.path + ".part")
+
+def save_image(path, framebuffer, colors=None):
+    ImageStream(path, framebuffer).finish(colors)
+
 #########################
 # Globals for Parallel Processing
 #########################
@@ -347,90 +1424,930 @@ GLOBAL_IMAGE_HEIGHT = None
 GLOBAL_SAMPLES_PER_PIXEL = None
 GLOBAL_MAX_DEPTH = None
 GLOBAL_CAM = None
+# Built from the scene file; only the view the engine needs is set.
 GLOBAL_WORLD = None
-
-def init_globals(image_width, image_height, samples_per_pixel, max_depth, cam, world):
+GLOBAL_ENGINE = "vec3"
+GLOBAL_SCENE_ARRAYS = None
+# Animation frame whose camera and sphere positions the globals hold.
+GLOBAL_FRAME = None
+GLOBAL_SEED = 0
+GLOBAL_FRAMEBUFFER = None
+# First-hit albedo/normal/depth buffer, only set when denoising.
+GLOBAL_AOV_BUFFER = None
+# Adaptive sampling is on when the threshold is set; GLOBAL_SAMPLES_PER_PIXEL is then the cap.
+GLOBAL_ADAPTIVE_THRESHOLD = None
+GLOBAL_ADAPTIVE_MIN_SPP = 8
+GLOBAL_RR_MIN_DEPTH = None
+
+ENGINES = ("vec3", "wavefront")
+
+def init_globals(image_width, image_height, samples_per_pixel, max_depth, cam, scene_path, engine="vec3",
+                 framebuffer_spec=None, adaptive_threshold=None, adaptive_min_spp=8, seed=0, stats=False,
+                 rr_min_depth=None, aov_spec=None):
     global GLOBAL_IMAGE_WIDTH, GLOBAL_IMAGE_HEIGHT, GLOBAL_SAMPLES_PER_PIXEL, GLOBAL_MAX_DEPTH, GLOBAL_CAM, GLOBAL_WORLD
+    global GLOBAL_ENGINE, GLOBAL_SCENE_ARRAYS, GLOBAL_SEED, GLOBAL_FRAMEBUFFER, GLOBAL_AOV_BUFFER
+    global GLOBAL_ADAPTIVE_THRESHOLD, GLOBAL_ADAPTIVE_MIN_SPP, GLOBAL_RR_MIN_DEPTH, GLOBAL_FRAME
     GLOBAL_IMAGE_WIDTH = image_width
     GLOBAL_IMAGE_HEIGHT = image_height
     GLOBAL_SAMPLES_PER_PIXEL = samples_per_pixel
     GLOBAL_MAX_DEPTH = max_depth
     GLOBAL_CAM = cam
-    GLOBAL_WORLD = world
-
-#########################
-# Worker Function: Render a Single Scanline
-#########################
-def render_scanline(j):
-    """Compute and return the list of pixel values for scanline j.
-       j is in [0, image_height-1], where 0 is the bottom scanline."""
-    scanline_pixels = []
-    for i in range(GLOBAL_IMAGE_WIDTH):
-        pixel_color = Vec3(0, 0, 0)
-        for s in range(GLOBAL_SAMPLES_PER_PIXEL):
-            u = (i + random_double()) / (GLOBAL_IMAGE_WIDTH - 1)
-            v = (j + random_double()) / (GLOBAL_IMAGE_HEIGHT - 1)
-            r = GLOBAL_CAM.get_ray(u, v)
-            pixel_color += ray_color(r, GLOBAL_WORLD, GLOBAL_MAX_DEPTH)
-        scale = 1.0 / GLOBAL_SAMPLES_PER_PIXEL
-        r_val = math.sqrt(pixel_color.x * scale)
-        g_val = math.sqrt(pixel_color.y * scale)
-        b_val = math.sqrt(pixel_color.z * scale)
-        ir = int(256 * clamp(r_val, 0.0, 0.999))
-        ig = int(256 * clamp(g_val, 0.0, 0.999))
-        ib = int(256 * clamp(b_val, 0.0, 0.999))
-        scanline_pixels.append((ir, ig, ib))
-    return j, scanline_pixels
+    GLOBAL_ENGINE = engine
+    GLOBAL_SEED = seed
+    GLOBAL_ADAPTIVE_THRESHOLD = adaptive_threshold
+    GLOBAL_ADAPTIVE_MIN_SPP = adaptive_min_spp
+    GLOBAL_RR_MIN_DEPTH = rr_min_depth
+    GLOBAL_FRAME = None
+    scene = SceneFile.open(scene_path)
+    # Only the vec3 engine needs the Sphere objects; every worker builds them once, here.
+    if engine == "wavefront":
+        GLOBAL_SCENE_ARRAYS = scene.arrays
+    else:
+        GLOBAL_WORLD = scene.world
+    if aov_spec is not None:
+        # The AOV pass uses the wavefront intersector with either engine.
+        GLOBAL_SCENE_ARRAYS = scene.arrays
+        GLOBAL_AOV_BUFFER = FrameBuffer.attach(aov_spec, image_width, image_height, AOV_CHANNELS)
+    if framebuffer_spec is not None:
+        GLOBAL_FRAMEBUFFER = FrameBuffer.attach(framebuffer_spec, image_width, image_height)
+    if stats:
+        enable_stats(max_depth)
+
+#########################
+# Worker Functions: Render Scanlines and Tiles
+#########################
+LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+
+def sample_pixel(i, j, samples):
+    """Return the colour sum and squared-luminance sum of `samples` samples of pixel (i, j)."""
+    pixel_color = Vec3(0, 0, 0)
+    luminance_sq = 0.0
+    for s in range(samples):
+        u = (i + random_double()) / (GLOBAL_IMAGE_WIDTH - 1)
+        v = (j + random_double()) / (GLOBAL_IMAGE_HEIGHT - 1)
+        r = GLOBAL_CAM.get_ray(u, v)
+        c = ray_color(r, GLOBAL_WORLD, GLOBAL_MAX_DEPTH, GLOBAL_RR_MIN_DEPTH)
+        pixel_color += c
+        luminance = 0.2126 * c.x + 0.7152 * c.y + 0.0722 * c.z
+        luminance_sq += luminance * luminance
+    return pixel_color, luminance_sq
+
+def sample_pixels_wavefront(i, j, samples):
+    """Wavefront version of sample_pixel for every pixel (i[k], j[k]) at once."""
+    rng = NP_RNG
+    i = np.repeat(i, samples)
+    j = np.repeat(j, samples)
+    u = (i + rng.random(len(i))) / (GLOBAL_IMAGE_WIDTH - 1)
+    v = (j + rng.random(len(j))) / (GLOBAL_IMAGE_HEIGHT - 1)
+    origins, directions = camera_rays(GLOBAL_CAM, u, v, rng)
+    colors = wavefront_ray_color(origins, directions, GLOBAL_SCENE_ARRAYS, GLOBAL_MAX_DEPTH, rng, GLOBAL_RR_MIN_DEPTH)
+    colors = colors.reshape(-1, samples, 3)
+    luminance = colors @ LUMINANCE_WEIGHTS
+    return colors.sum(axis=1), (luminance * luminance).sum(axis=1)
+
+def sample_pixels(i, j, samples):
+    """Return colour sums (n, 3) and squared-luminance sums (n,) for pixels (i[k], j[k])."""
+    if GLOBAL_ENGINE == "wavefront":
+        return sample_pixels_wavefront(i, j, samples)
+    sums = np.zeros((len(i), 3))
+    luminance_sq = np.zeros(len(i))
+    for k in range(len(i)):
+        c, luminance_sq[k] = sample_pixel(int(i[k]), int(j[k]), samples)
+        sums[k] = (c.x, c.y, c.z)
+    return sums, luminance_sq
+
+def render_tile(tile):
+    """Render one tile into GLOBAL_FRAMEBUFFER; return (tile, pid, seconds, stats counters or None).
+       Each seed block has its own random stream, so tiling does not change the image."""
+    start = time.perf_counter()
+    for x0, y0, width, height in tile.seed_blocks():
+        seed_stream(GLOBAL_SEED, STREAM_PIXELS, x0, y0, tile.sample_start)
+        render_block(x0, y0, width, height, tile.samples)
+        if GLOBAL_AOV_BUFFER is not None:
+            seed_stream(GLOBAL_SEED, STREAM_AOV, x0, y0)
+            render_block_aovs(x0, y0, width, height)
+    counters = STATS.take() if STATS is not None else None
+    return tile, os.getpid(), time.perf_counter() - start, counters
+
+def render_block(x0, y0, width, height, samples):
+    jj, ii = np.mgrid[y0:y0 + height, x0:x0 + width]
+    ii = ii.ravel()
+    jj = jj.ravel()
+    if GLOBAL_ADAPTIVE_THRESHOLD is None:
+        sums, _ = sample_pixels(ii, jj, samples)
+        GLOBAL_FRAMEBUFFER.add(x0, y0, sums.reshape(height, width, 3), samples)
+    else:
+        render_block_adaptive(ii, jj, samples)
+
+def render_block_aovs(x0, y0, width, height):
+    """Write the first-hit albedo, normal and depth of a block, averaged over AOV_SAMPLES rays, to GLOBAL_AOV_BUFFER."""
+    rng = NP_RNG
+    jj, ii = np.mgrid[y0:y0 + height, x0:x0 + width]
+    i = np.repeat(ii.ravel(), AOV_SAMPLES)
+    j = np.repeat(jj.ravel(), AOV_SAMPLES)
+    u = (i + rng.random(len(i))) / (GLOBAL_IMAGE_WIDTH - 1)
+    v = (j + rng.random(len(j))) / (GLOBAL_IMAGE_HEIGHT - 1)
+    origins, directions = camera_rays(GLOBAL_CAM, u, v, rng)
+    albedo, normal, depth = first_hit_aovs(origins, directions, GLOBAL_SCENE_ARRAYS)
+    aovs = np.concatenate((albedo, normal, depth[:, None]), axis=1).reshape(height, width, AOV_SAMPLES, AOV_CHANNELS)
+    GLOBAL_AOV_BUFFER.pixels[y0:y0 + height, x0:x0 + width] = aovs.mean(axis=2)
+
+def render_block_adaptive(ii, jj, cap):
+    """Sample pixels in batches until their noise estimate drops below the threshold, up to cap samples."""
+    n = len(ii)
+    count = np.zeros(n)
+    luminance_sum = np.zeros(n)
+    luminance_sq = np.zeros(n)
+    active = np.arange(n)
+    pixels = GLOBAL_FRAMEBUFFER.pixels
+    while len(active):
+        batch = min(GLOBAL_ADAPTIVE_MIN_SPP, cap - int(count[active[0]]))
+        sums, sq = sample_pixels(ii[active], jj[active], batch)
+        pixels[jj[active], ii[active], 3] += batch
+        pixels[jj[active], ii[active], :3] += sums
+        count[active] += batch
+        luminance_sum[active] += sums @ LUMINANCE_WEIGHTS
+        luminance_sq[active] += sq
+
+        c = count[active]
+        mean = luminance_sum[active] / c
+        variance = np.maximum(luminance_sq[active] / c - mean * mean, 0.0) * c / np.maximum(c - 1, 1)
+        error = np.sqrt(variance / c) / (2.0 * np.sqrt(np.maximum(mean, 1e-4)))
+        active = active[(error > GLOBAL_ADAPTIVE_THRESHOLD) & (c < cap)]
+
+#########################
+# Tile Scheduler
+#########################
+# Tiles are never split below this size. Tile edges stay on multiples of it,
+# and each MIN_TILE_SIZE square is a seed block with its own random stream.
+MIN_TILE_SIZE = 8
+# Primary rays traced per tile when estimating its cost.
+PROBE_RAYS_PER_TILE = 4
+
+class Tile:
+    """A rectangle of pixels (y0 = 0 is the bottom row) and the samples to add, numbered from sample_start."""
+    def __init__(self, x0, y0, width, height, samples, sample_start=0, cost=0.0):
+        self.x0 = x0
+        self.y0 = y0
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.sample_start = sample_start
+        self.cost = cost
+
+    def __repr__(self):
+        return f"Tile({self.x0}, {self.y0}, {self.width}, {self.height}, samples={self.samples})"
+
+    def pixel_count(self):
+        return self.width * self.height
+
+    def can_split(self):
+        return self.width > MIN_TILE_SIZE or self.height > MIN_TILE_SIZE
+
+    def seed_blocks(self):
+        """Yield (x0, y0, width, height) for the MIN_TILE_SIZE grid cells covered by this tile."""
+        for y0 in range(self.y0, self.y0 + self.height, MIN_TILE_SIZE):
+            for x0 in range(self.x0, self.x0 + self.width, MIN_TILE_SIZE):
+                yield (x0, y0,
+                       min(MIN_TILE_SIZE, self.x0 + self.width - x0),
+                       min(MIN_TILE_SIZE, self.y0 + self.height - y0))
+
+    def split(self):
+        """Halve the tile along its longer side, on a MIN_TILE_SIZE boundary; the cost is shared by area."""
+        if self.width > MIN_TILE_SIZE and (self.width >= self.height or self.height <= MIN_TILE_SIZE):
+            half = max(1, self.width // (2 * MIN_TILE_SIZE)) * MIN_TILE_SIZE
+            parts = [Tile(self.x0, self.y0, half, self.height, self.samples, self.sample_start),
+                     Tile(self.x0 + half, self.y0, self.width - half, self.height, self.samples, self.sample_start)]
+        else:
+            half = max(1, self.height // (2 * MIN_TILE_SIZE)) * MIN_TILE_SIZE
+            parts = [Tile(self.x0, self.y0, self.width, half, self.samples, self.sample_start),
+                     Tile(self.x0, self.y0 + half, self.width, self.height - half, self.samples, self.sample_start)]
+        for part in parts:
+            part.cost = self.cost * part.pixel_count() / self.pixel_count()
+        return parts
+
+def make_tiles(image_width, image_height, tile_size, samples_per_pixel, levels=None):
+    """Cut the image into tiles that bring every pixel up to samples_per_pixel, skipping checkpointed levels."""
+    tiles = []
+    for y0 in range(0, image_height, tile_size):
+        for x0 in range(0, image_width, tile_size):
+            tile = Tile(x0, y0, min(tile_size, image_width - x0), min(tile_size, image_height - y0),
+                        samples_per_pixel)
+            if levels is None:
+                tiles.append(tile)
+                continue
+            done = levels[y0 // MIN_TILE_SIZE:-(-(y0 + tile.height) // MIN_TILE_SIZE),
+                          x0 // MIN_TILE_SIZE:-(-(x0 + tile.width) // MIN_TILE_SIZE)]
+            if (done == done.flat[0]).all():
+                parts = [(tile, int(done.flat[0]))]
+            else:
+                parts = [(Tile(bx, by, w, h, samples_per_pixel), int(levels[by // MIN_TILE_SIZE, bx // MIN_TILE_SIZE]))
+                         for bx, by, w, h in tile.seed_blocks()]
+            for part, level in parts:
+                if level < samples_per_pixel:
+                    part.sample_start = level
+                    part.samples = samples_per_pixel - level
+                    tiles.append(part)
+    return tiles
+
+def estimate_tile_costs(tiles, image_width, image_height, cam, world, max_depth):
+    """Time a few one-sample paths through each tile. Glass and metal tiles come out expensive, sky tiles cheap."""
+    for tile in tiles:
+        start = time.perf_counter()
+        for _ in range(PROBE_RAYS_PER_TILE):
+            u = (tile.x0 + random_double() * tile.width) / (image_width - 1)
+            v = (tile.y0 + random_double() * tile.height) / (image_height - 1)
+            ray_color(cam.get_ray(u, v), world, max_depth)
+        tile.cost = (time.perf_counter() - start) * tile.pixel_count() * tile.samples
+
+class TileScheduler:
+    """Hand tiles to a process pool, most expensive first, splitting tiles when workers would idle."""
+    def __init__(self, executor, workers, tiles, task=render_tile):
+        self.executor = executor
+        self.workers = workers
+        self.task = task
+        self.queue = []
+        self.counter = itertools.count()
+        for tile in tiles:
+            self.push(tile)
+        self.busy = collections.defaultdict(float)
+        self.tiles_done = collections.defaultdict(int)
+        # Per-worker RenderStats totals, filled only when the workers count.
+        self.stats = collections.defaultdict(dict)
+
+    def push(self, tile):
+        heapq.heappush(self.queue, (-tile.cost, next(self.counter), tile))
+
+    def split_for_idle(self, idle):
+        while 0 < len(self.queue) < idle:
+            splittable = [entry for entry in self.queue if entry[2].can_split()]
+            if not splittable:
+                return
+            largest = max(splittable, key=lambda entry: entry[2].pixel_count())
+            self.queue.remove(largest)
+            heapq.heapify(self.queue)
+            for part in largest[2].split():
+                self.push(part)
+
+    def run(self):
+        """Yield each tile as it finishes."""
+        in_flight = set()
+        self.start = time.perf_counter()
+        while self.queue or in_flight:
+            self.split_for_idle(self.workers - len(in_flight))
+            while self.queue and len(in_flight) < self.workers:
+                _, _, tile = heapq.heappop(self.queue)
+                in_flight.add(self.executor.submit(self.task, tile))
+            done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                tile, pid, seconds, counters = future.result()
+                self.busy[pid] += seconds
+                self.tiles_done[pid] += 1
+                if counters is not None:
+                    merge_stats(self.stats[pid], counters)
+                yield tile
+        self.wall = time.perf_counter() - self.start
+
+    def utilisation_report(self):
+        lines = [f"Wall time: {self.wall:.2f}s over {self.workers} workers"]
+        for pid in sorted(self.busy):
+            share = self.busy[pid] / self.wall if self.wall > 0 else 0.0
+            lines.append(f"  worker {pid}: {self.tiles_done[pid]} tiles, busy {self.busy[pid]:.2f}s "
+                         f"({100.0 * share:.1f}%)")
+        total = sum(self.busy.values()) / (self.wall * self.workers) if self.wall > 0 else 0.0
+        lines.append(f"  overall utilisation: {100.0 * total:.1f}%")
+        return "\n".join(lines)
+
+#########################
+# Distributed Rendering
+#########################
+# A coordinator (--listen) hands tiles to workers on other hosts (--connect).
+# Messages are pickled, so both ends must share a secret key.
+AUTHKEY_ENV = "RENDER_AUTHKEY"
+# How long a worker keeps retrying while the coordinator is not up yet.
+CONNECT_RETRY_SECONDS = 30.0
+# How long a new connection has to authenticate and say hello.
+HANDSHAKE_TIMEOUT = 10.0
+# Default seconds a worker may spend on one tile before it is given to another worker.
+TILE_TIMEOUT = 600.0
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def resolve_authkey(args):
+    """The shared key as bytes; a loopback coordinator without one gets a random key."""
+    key = args.authkey or os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    if args.connect:
+        sys.exit(f"--connect needs the coordinator's key in --authkey or {AUTHKEY_ENV}")
+    host = parse_address(args.listen)[0]
+    if not is_loopback(host):
+        sys.exit(f"--listen on {host} needs an explicit key in --authkey or {AUTHKEY_ENV}")
+    key = secrets.token_hex(16)
+    print(f"Worker key: {key} (give it to the workers in --authkey or {AUTHKEY_ENV})", file=sys.stderr)
+    return key.encode()
+
+def parse_address(text):
+    """'host:port' -> (host, port)."""
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+def shutdown_connection(conn):
+    """Shut the socket of conn down, which wakes any thread blocked reading from it."""
+    try:
+        sock = socket.socket(fileno=os.dup(conn.fileno()))
+    except OSError:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+def recv_within(conn, seconds):
+    """conn.recv(), raising TimeoutError if no message starts within seconds and
+    EOFError or OSError if the rest of it does not arrive within seconds either."""
+    if not conn.poll(seconds):
+        raise TimeoutError(f"no message within {seconds:g}s")
+    watchdog = threading.Timer(seconds, shutdown_connection, (conn,))
+    watchdog.start()
+    try:
+        return conn.recv()
+    finally:
+        watchdog.cancel()
+
+def remote_worker(address, authkey):
+    """Connect to the coordinator at address and render the tiles it sends until it says stop."""
+    deadline = time.monotonic() + CONNECT_RETRY_SECONDS
+    while True:
+        try:
+            conn = connection.Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+    fd, scene_path = tempfile.mkstemp(suffix=".scene")
+    os.close(fd)
+    try:
+        with conn:
+            conn.send(("hello", socket.gethostname(), os.getpid()))
+            _, settings, scene_data = conn.recv()
+            SceneFile.write(scene_path, data=scene_data)
+            init_globals(scene_path=scene_path, framebuffer_spec=("memory", None), **settings)
+            while True:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    break
+                if message[0] == "stop":
+                    break
+                tile, _, seconds, counters = render_tile(message[1])
+                block = GLOBAL_FRAMEBUFFER.take_block(tile.x0, tile.y0, tile.width, tile.height)
+                conn.send(("done", tile, seconds, counters, block))
+    finally:
+        os.remove(scene_path)
+
+def run_remote_workers(address, authkey, workers):
+    """Run `workers` remote_worker processes against one coordinator and wait for them."""
+    if workers == 1:
+        remote_worker(address, authkey)
+        return
+    processes = [multiprocessing.Process(target=remote_worker, args=(address, authkey)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+class RemoteTileScheduler(TileScheduler):
+    """TileScheduler for workers that connect over TCP; a lost or timed-out worker's tile is requeued."""
+    def __init__(self, listener, authkey, setup, framebuffer, tiles, tile_timeout=TILE_TIMEOUT):
+        super().__init__(None, 0, tiles)
+        self.listener = listener
+        self.authkey = authkey
+        self.setup = setup
+        self.tile_timeout = tile_timeout
+        self.framebuffer = framebuffer
+        self.joined = queue.Queue()
+        self.closing = False
+        self.lost_tiles = 0
+
+    def accept(self):
+        """Accept connections on a background thread and greet each on a thread of its own."""
+        while not self.closing:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                continue
+            if self.closing:
+                # The wake-up connection from close_listener.
+                conn.close()
+                break
+            threading.Thread(target=self.greet, args=(conn,), daemon=True).start()
+
+    def close_listener(self, accept_thread):
+        """Stop the accept thread, which closing the listener alone does not wake, and close the listener."""
+        self.closing = True
+        host, port = self.listener.address[:2]
+        host = {"": "127.0.0.1", "0.0.0.0": "127.0.0.1", "::": "::1"}.get(host, host)
+        try:
+            socket.create_connection((host, port), timeout=HANDSHAKE_TIMEOUT).close()
+        except OSError:
+            pass
+        accept_thread.join(HANDSHAKE_TIMEOUT)
+        self.listener.close()
+
+    def greet(self, conn):
+        """Authenticate a new connection and send it the setup; the run loop picks it up from self.joined."""
+        # The challenge exchange cannot time out by itself, so a watchdog
+        # shuts the connection down if the client stalls.
+        watchdog = threading.Timer(HANDSHAKE_TIMEOUT, shutdown_connection, (conn,))
+        watchdog.start()
+        try:
+            connection.deliver_challenge(conn, self.authkey)
+            connection.answer_challenge(conn, self.authkey)
+            _, host, pid = recv_within(conn, HANDSHAKE_TIMEOUT)
+            conn.send(self.setup)
+        except (OSError, EOFError, ValueError, connection.AuthenticationError):
+            conn.close()
+            return
+        finally:
+            watchdog.cancel()
+        self.joined.put((conn, f"{host}:{pid}"))
+
+    def drop(self, conn, name, tile, reason="disconnected"):
+        print(f"Worker {name} {reason}; requeueing {tile}", file=sys.stderr)
+        conn.close()
+        self.lost_tiles += 1
+        self.push(tile)
+
+    def run(self):
+        """Yield each tile as it finishes."""
+        names = {}
+        idle = []
+        in_flight = {}
+        self.start = time.perf_counter()
+        accept_thread = threading.Thread(target=self.accept, daemon=True)
+        accept_thread.start()
+        try:
+            while self.queue or in_flight:
+                while not self.joined.empty():
+                    conn, names[conn] = self.joined.get()
+                    idle.append(conn)
+                    self.workers = max(self.workers, len(names))
+                self.split_for_idle(len(idle))
+                while self.queue and idle:
+                    conn = idle.pop()
+                    _, _, tile = heapq.heappop(self.queue)
+                    try:
+                        conn.send(("tile", tile))
+                    except OSError:
+                        self.drop(conn, names.pop(conn), tile)
+                        continue
+                    in_flight[conn] = (tile, time.monotonic() + self.tile_timeout)
+                if not in_flight:
+                    time.sleep(0.1)
+                    continue
+                # A worker that hangs, or whose host vanished without closing
+                # the connection, loses its tile once the deadline passes.
+                now = time.monotonic()
+                for conn, (tile, deadline) in list(in_flight.items()):
+                    if now > deadline:
+                        del in_flight[conn]
+                        self.drop(conn, names.pop(conn), tile, f"timed out after {self.tile_timeout:g}s")
+                for conn in connection.wait(list(in_flight), timeout=0.1):
+                    tile, _ = in_flight.pop(conn)
+                    try:
+                        _, tile, seconds, counters, block = recv_within(conn, HANDSHAKE_TIMEOUT)
+                    except (EOFError, OSError):
+                        self.drop(conn, names.pop(conn), tile)
+                        continue
+                    name = names[conn]
+                    self.framebuffer.add_block(tile.x0, tile.y0, block)
+                    self.busy[name] += seconds
+                    self.tiles_done[name] += 1
+                    if counters is not None:
+                        merge_stats(self.stats[name], counters)
+                    idle.append(conn)
+                    yield tile
+        finally:
+            self.close_listener(accept_thread)
+            while not self.joined.empty():
+                conn, names[conn] = self.joined.get()
+            for conn in names:
+                try:
+                    conn.send(("stop",))
+                except OSError:
+                    pass
+                conn.close()
+        self.wall = time.perf_counter() - self.start
+
+def serve_tiles(framebuffer, tiles, address, authkey, world, settings, on_tile=None, tile_timeout=TILE_TIMEOUT):
+    """Coordinate a render by remote workers and return the RemoteTileScheduler."""
+    # Authentication happens per connection in RemoteTileScheduler.greet.
+    listener = connection.Listener(address)
+    print(f"Waiting for workers on {address[0]}:{listener.address[1]}", file=sys.stderr)
+    scheduler = RemoteTileScheduler(listener, authkey, ("setup", settings, SceneFile.pack(world)), framebuffer, tiles,
+                                    tile_timeout)
+    for tile in scheduler.run():
+        if on_tile is not None:
+            on_tile(tile)
+    return scheduler
+
+#########################
+# Animation
+#########################
+# All frames share one pool; each tile carries its frame's camera and sphere moves.
+class FrameUpdate:
+    def __init__(self, frame, cam, indices, centers):
+        self.frame = frame
+        self.cam = cam
+        self.indices = indices
+        self.centers = centers
+
+class Animation:
+    """Keyframed camera and sphere motion (see the README), interpolated linearly."""
+    def __init__(self, frames, camera_keys, sphere_keys):
+        self.frames = frames
+        self.camera_keys = sorted(camera_keys, key=lambda key: key["frame"])
+        self.sphere_keys = {int(index): sorted(keys, key=lambda key: key["frame"])
+                            for index, keys in sphere_keys.items()}
+
+    @staticmethod
+    def load(path, sphere_count):
+        """Read and check an animation; raises ValueError saying what is wrong with the file."""
+        with open(path) as f:
+            spec = json.load(f)
+        if not isinstance(spec, dict):
+            raise ValueError("expected a JSON object")
+        frames = spec.get("frames")
+        if not isinstance(frames, int) or isinstance(frames, bool) or frames < 1:
+            raise ValueError('"frames" must be a positive integer')
+        camera = spec.get("camera", [])
+        Animation.check_keys("camera", camera, DEFAULT_VIEW, ())
+        spheres = spec.get("spheres", {})
+        if not isinstance(spheres, dict):
+            raise ValueError('"spheres" must map sphere indices to keyframe lists')
+        for index, keys in spheres.items():
+            if not index.isdigit() or int(index) >= sphere_count:
+                raise ValueError(f'sphere "{index}" is not an index below the scene\'s {sphere_count} spheres')
+            if not keys:
+                raise ValueError(f'sphere "{index}" has no keyframes')
+            Animation.check_keys(f'sphere "{index}"', keys, ("center",), ("center",))
+        return Animation(frames, camera, spheres)
+
+    @staticmethod
+    def check_keys(what, keys, fields, required):
+        """Check a keyframe list: frames in non-decreasing order, known fields only."""
+        if not isinstance(keys, list) or not all(isinstance(key, dict) for key in keys):
+            raise ValueError(f"{what} needs a list of keyframe objects")
+        previous = None
+        for key in keys:
+            frame = key.get("frame")
+            if not isinstance(frame, (int, float)) or isinstance(frame, bool):
+                raise ValueError(f'every {what} keyframe needs a numeric "frame"')
+            if previous is not None and frame < previous:
+                raise ValueError(f"{what} keyframes must be in non-decreasing frame order ({frame} after {previous})")
+            previous = frame
+            for field, value in key.items():
+                if field == "frame":
+                    continue
+                if field not in fields:
+                    raise ValueError(f'unknown {what} keyframe field "{field}"')
+                size = 1 if field == "vfov" else 3
+                values = [value] if size == 1 else value
+                if (not isinstance(values, list) or len(values) != size
+                        or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)):
+                    raise ValueError(f'{what} "{field}" at frame {frame} must be '
+                                     + ("a number" if size == 1 else "a list of 3 numbers"))
+            for field in required:
+                if field not in key:
+                    raise ValueError(f'{what} keyframe at frame {frame} has no "{field}"')
+
+    @staticmethod
+    def interpolate(keys, frame, field, default):
+        keys = [key for key in keys if field in key]
+        if not keys:
+            return default
+        if frame <= keys[0]["frame"]:
+            return keys[0][field]
+        for a, b in zip(keys, keys[1:]):
+            if frame <= b["frame"]:
+                t = (frame - a["frame"]) / (b["frame"] - a["frame"])
+                return ((1.0 - t) * np.asarray(a[field], dtype=float) + t * np.asarray(b[field], dtype=float)).tolist()
+        return keys[-1][field]
+
+    def update(self, frame, image_width, image_height):
+        view = {field: self.interpolate(self.camera_keys, frame, field, default)
+                for field, default in DEFAULT_VIEW.items()}
+        indices = sorted(self.sphere_keys)
+        centers = [self.interpolate(self.sphere_keys[index], frame, "center", None) for index in indices]
+        return FrameUpdate(frame, default_camera(image_width, image_height, view), indices, centers)
+
+def move_spheres(world, indices, centers):
+    """Move spheres of world to new centres and refit its BVH, if it has one."""
+    for index, center in zip(indices, centers):
+        world.objects[index].center = Vec3(*center)
+    if indices and isinstance(world, BVH):
+        world.refit()
+
+def apply_frame_update(update):
+    global GLOBAL_CAM, GLOBAL_FRAME
+    GLOBAL_CAM = update.cam
+    if update.indices:
+        if GLOBAL_WORLD is not None:
+            move_spheres(GLOBAL_WORLD, update.indices, update.centers)
+        if GLOBAL_SCENE_ARRAYS is not None:
+            # The mapped scene file is read-only; only the centres get a private copy.
+            if not GLOBAL_SCENE_ARRAYS.centers.flags.writeable:
+                GLOBAL_SCENE_ARRAYS.centers = GLOBAL_SCENE_ARRAYS.centers.copy()
+            GLOBAL_SCENE_ARRAYS.centers[update.indices] = update.centers
+    GLOBAL_FRAME = update.frame
+
+def render_frame_tile(update, tile):
+    """render_tile for one animation frame, bringing this worker's scene up to that frame first."""
+    if update.frame != GLOBAL_FRAME:
+        apply_frame_update(update)
+    return render_tile(tile)
+
+def render_animation(framebuffer, animation, image_width, image_height, tile_size, samples_per_pixel, max_depth,
+                     world, engine="vec3", workers=1, adaptive=None, min_spp=8, seed=0, rr_min_depth=RR_MIN_DEPTH,
+                     on_frame=None):
+    """Render every frame on one process pool; on_frame(frame, scheduler) runs as each one completes."""
+    first = animation.update(0, image_width, image_height)
+    with temporary_scene_file(world) as scene_path, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_globals,
+                                                   initargs=(image_width, image_height, samples_per_pixel, max_depth,
+                                                             first.cam, scene_path, engine, framebuffer.spec,
+                                                             adaptive, min_spp, seed, False,
+                                                             rr_min_depth)) as executor:
+        for frame in range(animation.frames):
+            update = animation.update(frame, image_width, image_height)
+            # The main process moves its own copy too, for the tile cost probe.
+            move_spheres(world, update.indices, update.centers)
+            framebuffer.pixels.fill(0.0)
+            tiles = make_tiles(image_width, image_height, tile_size, samples_per_pixel)
+            seed_stream(seed, STREAM_PROBE)
+            estimate_tile_costs(tiles, image_width, image_height, update.cam, world, max_depth)
+            scheduler = TileScheduler(executor, workers, tiles, functools.partial(render_frame_tile, update))
+            for _ in scheduler.run():
+                pass
+            if on_frame is not None:
+                on_frame(frame, scheduler)
+
+def frame_path_pattern(output):
+    """'render.png' -> 'render_{:04d}.png'; a pattern that already has a {} field is kept."""
+    if "{" in output:
+        return output
+    root, ext = os.path.splitext(output)
+    return root + "_{:04d}" + ext
 
 #########################
 # Main Rendering Function
 #########################
-def main():
+# lookfrom, lookat and vfov of the default view; animations interpolate these.
+DEFAULT_VIEW = {"lookfrom": [13, 2, 3], "lookat": [0, 0, 0], "vfov": 20}
+
+def default_camera(image_width, image_height, view=DEFAULT_VIEW):
+    lookfrom = Vec3(*view["lookfrom"])
+    lookat = Vec3(*view["lookat"])
+    vup = Vec3(0, 1, 0)
+    dist_to_focus = 10.0
+    aperture = 0.0
+    return Camera(lookfrom, lookat, vup, view["vfov"], image_width / image_height, aperture, dist_to_focus)
+
+def render_tiles(framebuffer, tiles, image_width, image_height, samples_per_pixel, max_depth, cam, world,
+                 engine="vec3", workers=1, adaptive=None, min_spp=8, seed=0, on_tile=None, stats=False,
+                 rr_min_depth=RR_MIN_DEPTH, aov_buffer=None):
+    """Render tiles into framebuffer on a process pool, calling on_tile(tile) as each one finishes.
+       Returns the TileScheduler."""
+    with temporary_scene_file(world) as scene_path, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_globals,
+                                                   initargs=(image_width, image_height, samples_per_pixel, max_depth,
+                                                             cam, scene_path, engine, framebuffer.spec,
+                                                             adaptive, min_spp, seed, stats, rr_min_depth,
+                                                             aov_buffer and aov_buffer.spec)) as executor:
+        scheduler = TileScheduler(executor, workers, tiles)
+        for tile in scheduler.run():
+            if on_tile is not None:
+                on_tile(tile)
+    return scheduler
+
+def render_image(world, cam, image_width, image_height, samples_per_pixel, max_depth,
+                 engine="vec3", workers=1, tile_size=32, seed=0, rr_min_depth=RR_MIN_DEPTH, denoised=False):
+    """Render a whole image, denoised if asked; return (uint8 image, TileScheduler)."""
+    framebuffer = FrameBuffer.create(image_width, image_height)
+    aov_buffer = FrameBuffer.create(image_width, image_height, AOV_CHANNELS) if denoised else None
+    try:
+        tiles = make_tiles(image_width, image_height, tile_size, samples_per_pixel)
+        seed_stream(seed, STREAM_PROBE)
+        estimate_tile_costs(tiles, image_width, image_height, cam, world, max_depth)
+        scheduler = render_tiles(framebuffer, tiles, image_width, image_height, samples_per_pixel, max_depth,
+                                 cam, world, engine, workers, seed=seed, rr_min_depth=rr_min_depth,
+                                 aov_buffer=aov_buffer)
+        image = framebuffer.tone_map(denoise(framebuffer, aov_buffer) if denoised else None)
+    finally:
+        for buffer in (framebuffer, aov_buffer):
+            if buffer is not None:
+                buffer.close()
+                buffer.unlink()
+    return image, scheduler
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render the random sphere scene.")
+    parser.add_argument("--engine", choices=ENGINES, default="vec3",
+                        help="vec3 traces one ray at a time, wavefront traces NumPy batches")
+    parser.add_argument("--width", type=int, default=400)
+    parser.add_argument("--height", type=int, default=200)
+    parser.add_argument("--spp", type=int, default=50, help="samples per pixel")
+    parser.add_argument("--max-depth", type=int, default=50)
+    parser.add_argument("--no-bvh", action="store_true",
+                        help="test every sphere linearly instead of using the BVH (vec3 engine)")
+    parser.add_argument("--tile-size", type=int, default=32, help="edge length of the square render tiles")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--adaptive", type=float, metavar="THRESHOLD", default=None,
+                        help="keep sampling a pixel until its noise estimate drops below THRESHOLD "
+                             "(about 0.01); --spp then caps the samples per pixel")
+    parser.add_argument("--min-spp", type=int, default=8, help="sample batch size in adaptive mode")
+    parser.add_argument("--heatmap", default=None, help="write a sample-count heatmap PNG here")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="master seed; the same seed gives the same image for any worker count")
+    parser.add_argument("--checkpoint", metavar="DIR", default=None,
+                        help="keep the accumulation buffer in DIR; rerunning resumes it, and a higher "
+                             "--spp adds samples to it")
+    parser.add_argument("--rr-depth", type=int, default=RR_MIN_DEPTH,
+                        help="bounces before Russian roulette may end a path")
+    parser.add_argument("--no-rr", action="store_true", help="disable Russian roulette")
+    parser.add_argument("--denoise", action="store_true",
+                        help="also render first-hit albedo/normal/depth buffers and denoise the image with them")
+    parser.add_argument("--stats", metavar="PATH", default=None,
+                        help="count rays, intersection tests, bounces and material terminations in the "
+                             "workers and write the totals to PATH as JSON")
+    parser.add_argument("--listen", metavar="HOST:PORT", default=None,
+                        help="coordinate the render for remote workers instead of using a local pool")
+    parser.add_argument("--connect", metavar="HOST:PORT", default=None,
+                        help="run --workers remote worker processes for the coordinator at HOST:PORT")
+    parser.add_argument("--authkey", default=None,
+                        help=f"shared key for --listen/--connect (default: ${AUTHKEY_ENV}; a coordinator on "
+                             "loopback without one prints a random key)")
+    parser.add_argument("--tile-timeout", type=float, default=TILE_TIMEOUT,
+                        help="with --listen, seconds before a worker's unfinished tile is given to another worker")
+    parser.add_argument("--animate", metavar="JSON", default=None,
+                        help="render the keyframed camera and sphere motion in JSON as numbered frames")
+    parser.add_argument("--output", default="outputcompleteee.png",
+                        help="image path; with --animate, a pattern such as frame_{:04d}.png")
+    args = parser.parse_args(argv)
+    for name in ("width", "height", "spp", "max_depth", "tile_size", "workers", "min_spp", "rr_depth"):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    for name in ("adaptive", "tile_timeout"):
+        value = getattr(args, name)
+        if value is not None and not value > 0:
+            parser.error(f"--{name.replace('_', '-')} must be positive")
+    return args
+
+def render_animation_frames(args, world, tile_size):
+    """The --animate branch of main: render the animation and save one PNG per frame."""
+    if args.checkpoint or args.listen or args.stats or args.denoise:
+        sys.exit("--animate cannot be combined with --checkpoint, --listen, --stats or --denoise")
+    try:
+        animation = Animation.load(args.animate, len(world.objects))
+    except (OSError, ValueError) as e:
+        sys.exit(f"--animate {args.animate}: {e}")
+    pattern = frame_path_pattern(args.output)
+    framebuffer = FrameBuffer.create(args.width, args.height)
+
+    def on_frame(frame, scheduler):
+        path = pattern.format(frame)
+        save_image(path, framebuffer)
+        print(f"Frame {frame + 1}/{animation.frames} rendered in {scheduler.wall:.2f}s and saved as {path}",
+              file=sys.stderr)
+
+    try:
+        render_animation(framebuffer, animation, args.width, args.height, tile_size, args.spp, args.max_depth,
+                         world, args.engine, args.workers, args.adaptive, args.min_spp, args.seed,
+                         None if args.no_rr else args.rr_depth, on_frame)
+    finally:
+        framebuffer.close()
+        framebuffer.unlink()
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.connect:
+        run_remote_workers(parse_address(args.connect), resolve_authkey(args), args.workers)
+        return
+
     # Image settings
-    image_width = 400
-    image_height = 200
-    samples_per_pixel = 50
-    max_depth = 50
+    image_width = args.width
+    image_height = args.height
+    samples_per_pixel = args.spp
+    max_depth = args.max_depth
 
     # Build the world
-    world = random_scene()
+    world = random_scene(use_bvh=not args.no_bvh, seed=args.seed)
 
     # Camera settings
-    lookfrom = Vec3(13, 2, 3)
-    lookat = Vec3(0, 0, 0)
-    vup = Vec3(0, 1, 0)
-    dist_to_focus = 10.0
-    aperture = 0.0
-    cam = Camera(lookfrom, lookat, vup, 20, image_width / image_height, aperture, dist_to_focus)
-
-    # Prepare for parallel rendering
-    scanlines = list(range(image_height))  # j in [0, image_height-1], 0 = bottom
-    results = {}
-    total_scanlines = image_height
-
-    # Use ProcessPoolExecutor for parallel processing.
-    with concurrent.futures.ProcessPoolExecutor(initializer=init_globals,
-                                                initargs=(image_width, image_height, samples_per_pixel, max_depth, cam, world)) as executor:
-        futures = {executor.submit(render_scanline, j): j for j in scanlines}
-        completed = 0
-        for future in concurrent.futures.as_completed(futures):
-            j, scanline_data = future.result()
-            results[j] = scanline_data
-            completed += 1
-            # Progress tracker printed to stderr.
-            print(f"Progress: {completed}/{total_scanlines} scanlines rendered", file=sys.stderr)
-
-    # Assemble the image. Our workers produced scanlines where j=0 is the bottom.
-    # Image arrays usually have row 0 at the top. So we flip the order.
-    image_array = np.zeros((image_height, image_width, 3), dtype=np.uint8)
-    for j in range(image_height):
-        # Flip vertically: row (image_height-1 - j) gets scanline j.
-        image_array[image_height - 1 - j, :] = np.array(results[j], dtype=np.uint8)
-
-    # Create and save the PNG image using Pillow.
-    img = Image.fromarray(image_array, 'RGB')
-    img.save("outputcompleteee.png")
-    print("Rendered image saved as outputcompleteee.png", file=sys.stderr)
+    cam = default_camera(image_width, image_height)
+
+    # Split the image into tiles and order them by estimated cost.
+    tile_size = max(1, round(args.tile_size / MIN_TILE_SIZE)) * MIN_TILE_SIZE
+
+    if args.animate:
+        render_animation_frames(args, world, tile_size)
+        return
+    if args.denoise and (args.checkpoint or args.listen):
+        sys.exit("--denoise cannot be combined with --checkpoint or --listen")
+    authkey = resolve_authkey(args) if args.listen else None
+
+    # With --checkpoint the shared buffer is a file and finished blocks are skipped.
+    checkpoint = None
+    rr_min_depth = None if args.no_rr else args.rr_depth
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, {"width": image_width, "height": image_height,
+                                                  "seed": args.seed, "max_depth": max_depth,
+                                                  "engine": args.engine, "adaptive": args.adaptive,
+                                                  "min_spp": args.min_spp, "rr_min_depth": rr_min_depth})
+        if checkpoint.repaired:
+            print(f"Checkpoint: re-rendering {checkpoint.repaired} interrupted blocks", file=sys.stderr)
+        framebuffer = checkpoint.framebuffer
+        tiles = make_tiles(image_width, image_height, tile_size, samples_per_pixel, checkpoint.levels())
+    else:
+        framebuffer = FrameBuffer.create(image_width, image_height)
+        tiles = make_tiles(image_width, image_height, tile_size, samples_per_pixel)
+    aov_buffer = FrameBuffer.create(image_width, image_height, AOV_CHANNELS) if args.denoise else None
+    seed_stream(args.seed, STREAM_PROBE)
+    estimate_tile_costs(tiles, image_width, image_height, cam, world, max_depth)
+    total_pixels = sum(tile.pixel_count() for tile in tiles)
+    # Finished rows are written as the render goes, except when the whole
+    # image has to be denoised first.
+    stream = ImageStream(args.output, framebuffer, None if args.denoise else tiles)
+
+    completed = 0
+
+    def on_tile(tile):
+        nonlocal completed
+        if checkpoint is not None:
+            checkpoint.record(tile)
+        if aov_buffer is None:
+            stream.tile_done(tile)
+        completed += tile.pixel_count()
+        # Progress tracker printed to stderr.
+        print(f"Progress: {completed}/{total_pixels} pixels rendered", file=sys.stderr)
+
+    try:
+        if args.listen:
+            settings = {"image_width": image_width, "image_height": image_height,
+                        "samples_per_pixel": samples_per_pixel, "max_depth": max_depth, "cam": cam,
+                        "engine": args.engine, "adaptive_threshold": args.adaptive, "adaptive_min_spp": args.min_spp,
+                        "seed": args.seed, "stats": args.stats is not None, "rr_min_depth": rr_min_depth}
+            scheduler = serve_tiles(framebuffer, tiles, parse_address(args.listen), authkey,
+                                    world, settings, on_tile, args.tile_timeout)
+        else:
+            scheduler = render_tiles(framebuffer, tiles, image_width, image_height, samples_per_pixel, max_depth,
+                                     cam, world, args.engine, args.workers, args.adaptive, args.min_spp, args.seed,
+                                     on_tile, stats=args.stats is not None, rr_min_depth=rr_min_depth,
+                                     aov_buffer=aov_buffer)
+        print(scheduler.utilisation_report(), file=sys.stderr)
+        if args.stats:
+            totals = {}
+            for counters in scheduler.stats.values():
+                merge_stats(totals, counters)
+            summary = stats_summary(totals, scheduler.wall, scheduler.stats)
+            summary["settings"] = {key: value for key, value in vars(args).items() if key != "authkey"}
+            with open(args.stats, "w") as f:
+                json.dump(summary, f, indent=2)
+            print(f"Render statistics saved as {args.stats}", file=sys.stderr)
+
+        # Write whatever the stream still holds back (everything, when denoising).
+        if aov_buffer is not None:
+            start = time.perf_counter()
+            stream.finish(denoise(framebuffer, aov_buffer))
+            print(f"Denoised in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        else:
+            stream.finish()
+        mean_spp = float(framebuffer.pixels[..., 3].mean())
+        print(f"Average samples per pixel: {mean_spp:.1f} (cap {samples_per_pixel})", file=sys.stderr)
+        if args.heatmap:
+            Image.fromarray(framebuffer.sample_heatmap(), 'RGB').save(args.heatmap)
+            print(f"Sample-count heatmap saved as {args.heatmap}", file=sys.stderr)
+    finally:
+        stream.abort()
+        if checkpoint is not None:
+            checkpoint.close()
+        else:
+            framebuffer.close()
+            framebuffer.unlink()
+        if aov_buffer is not None:
+            aov_buffer.close()
+            aov_buffer.unlink()
+    print(f"Rendered image saved as {args.output}", file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Render one of the assignment scenes to a PNG file without a display.
+
+    python render_assignment.py 3 --width 600 --height 600 --output a3.png
+
+The assignment scripts are imported as modules (importing them renders
+nothing), their NumPy renderers are called and the result is written with
+Pillow. Matplotlib is only imported for --preview.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# File and default resolution of each assignment script.
+ASSIGNMENTS = {
+    "1": ("assignment 1.py", 500, 500),
+    "2": ("assignment 2.py", 800, 800),
+    "3": ("assignment 3.py", 300, 300),
+}
+FOV = np.pi / 3
+
+def load_script(name, file_name):
+    """Import a script from this directory as module name (the file names are not valid module names)."""
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, file_name))
+        module = importlib.util.module_from_spec(spec)
+        # Register before executing so worker processes can unpickle functions from it.
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+def load_assignment(number):
+    """Import an assignment script."""
+    return load_script(f"assignment{number}", ASSIGNMENTS[number][0])
+
+def render(number, width, height, recursion_depth=3, per_pixel=False):
+    """Render an assignment's default scene; return a (height, width, 3) uint8 image.
+
+    per_pixel selects the original pixel-by-pixel renderer instead of the NumPy one."""
+    module = load_assignment(number)
+    if number == "1":
+        image = (module.render if per_pixel else module.render_vectorized)(width, height)
+    elif number == "2":
+        image = (module.render if per_pixel else module.render_vectorized)(module.scene, width, height, FOV)
+    else:
+        image = (module.render if per_pixel else module.render_vectorized)(module.scene, width, height, FOV,
+                                                                           recursion_depth)
+    # Match the / 255 scaling and clipping of the Matplotlib previews.
+    return np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+def preview(image, title=None):
+    import matplotlib.pyplot as plt
+    plt.imshow(image)
+    plt.axis('off')
+    if title:
+        plt.title(title)
+    plt.show()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render an assignment scene to PNG.")
+    parser.add_argument("assignment", choices=sorted(ASSIGNMENTS))
+    parser.add_argument("--width", type=int, default=None, help="defaults to the assignment's own size")
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=3, help="reflection depth (assignment 3)")
+    parser.add_argument("--per-pixel", action="store_true", help="use the original per-pixel renderer")
+    parser.add_argument("--output", default=None, help="PNG path (default assignmentN.png)")
+    parser.add_argument("--preview", action="store_true", help="also show the image with Matplotlib")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    _, default_width, default_height = ASSIGNMENTS[args.assignment]
+    width = args.width or default_width
+    height = args.height or default_height
+    output = args.output or f"assignment{args.assignment}.png"
+
+    start = time.perf_counter()
+    image = render(args.assignment, width, height, args.depth, args.per_pixel)
+    Image.fromarray(image, 'RGB').save(output)
+    print(f"Rendered assignment {args.assignment} ({width}x{height}) in {time.perf_counter() - start:.2f}s "
+          f"and saved it as {output}", file=sys.stderr)
+    if args.preview:
+        preview(image, f"Assignment {args.assignment}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
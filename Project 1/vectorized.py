@@ -0,0 +1,47 @@
+"""Pieces shared by the NumPy renderers of the assignments.
+
+The assignment scripts import this module by name, so it has to stay next
+to them.
+"""
+import numpy as np
+
+# Upper bound on the elements (rays x spheres, or x lights) a renderer
+# evaluates at once; rows are processed in blocks below this size.
+CHUNK_ELEMENTS = 1 << 21
+
+class PackedScene:
+    """An assignment scene dict packed into arrays once, for batched tracing.
+
+    Spheres without a reflective attribute (assignment 2) pack as 0."""
+    def __init__(self, scene):
+        spheres = scene['spheres']
+        self.centers = np.array([sphere.center for sphere in spheres], dtype=float).reshape(-1, 3)
+        self.radii = np.array([sphere.radius for sphere in spheres], dtype=float)
+        self.colors = np.array([sphere.color for sphere in spheres], dtype=float).reshape(-1, 3)
+        self.specular = np.array([sphere.specular for sphere in spheres], dtype=float)
+        self.reflective = np.array([getattr(sphere, 'reflective', 0.0) for sphere in spheres], dtype=float)
+
+        # Lights grouped by type, so no light_type checks are left in the per-ray work
+        lights = scene['lights']
+        self.ambient = sum(light.intensity for light in lights if light.light_type == "ambient")
+        points = [light for light in lights if light.light_type == "point"]
+        directionals = [light for light in lights if light.light_type == "directional"]
+        self.point_positions = np.array([light.position for light in points], dtype=float).reshape(-1, 3)
+        self.point_intensities = np.array([light.intensity for light in points], dtype=float)
+        directions = np.array([light.direction for light in directionals], dtype=float).reshape(-1, 3)
+        self.directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+        self.direction_intensities = np.array([light.intensity for light in directionals], dtype=float)
+
+def add_light(i, N, V, s, L, intensity, lit=None):
+    """Add the diffuse and specular terms of unit light vectors L (..., K, 3) to intensities i.
+
+    lit, if given, is a (..., K) mask of the light vectors that are not shadowed."""
+    if lit is not None:
+        intensity = np.where(lit, intensity, 0.0)
+    n_dot_l = np.einsum('...k,...lk->...l', N, L)
+    i += np.sum(intensity * np.maximum(n_dot_l, 0.0), axis=-1)
+    R = 2 * N[..., None, :] * n_dot_l[..., None] - L
+    r_dot_v = np.einsum('...lk,...k->...l', R, V)
+    # Base 1 where r_dot_v <= 0 keeps the unused powers finite
+    specular = np.where(r_dot_v > 0, np.where(r_dot_v > 0, r_dot_v, 1.0) ** s[..., None], 0.0)
+    i += np.where(s != -1, np.sum(intensity * specular, axis=-1), 0.0)
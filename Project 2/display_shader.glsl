@@ -0,0 +1,13 @@
+#version 330 core
+
+out vec4 FragColor;
+in vec2 TexCoords;
+
+// Running average of the traced samples (linear colour)
+uniform sampler2D uAccum;
+
+void main()
+{
+    vec3 color = texture(uAccum, TexCoords).rgb;
+    FragColor = vec4(sqrt(color), 1.0); // Gamma correction (gamma=2.0)
+}
@@ -9,20 +9,30 @@ uniform vec3 uLowerLeftCorner;
 uniform vec3 uHorizontal;
 uniform vec3 uVertical;
 
-// Scene uniforms (increased array sizes for more spheres)
+// Scene buffer (see pack_scene and build_bvh in main.py). Texel i < uNumSpheres
+// holds (center, radius) of sphere i. The material of sphere i follows the
+// geometry in texels uNumSpheres + 2i = (albedo, type) and
+// uNumSpheres + 2i + 1 = (fuzz, ref_idx, -, -).
+// Types: 0 = Lambertian, 1 = Metal, 2 = Dielectric
+// The BVH nodes come last, two texels each from 3 * uNumSpheres on:
+// (min, skip) and (max, sphere index, or -1 for an inner node).
 uniform int uNumSpheres;
-uniform vec3 uSphereCenter[128];
-uniform float uSphereRadius[128];
-uniform int   uMaterialType[128];  // 0 = Lambertian, 1 = Metal, 2 = Dielectric
-uniform vec3  uSphereAlbedo[128];
-uniform float uSphereFuzz[128];
-uniform float uSphereRefIdx[128];
-
-// Random seed
+uniform int uNumNodes;
+uniform samplerBuffer uScene;
+
+// Random seed (a new one every frame)
 uniform float uSeed;
 
-const int MAX_DEPTH = 50;
-const int SAMPLES = 25;  // Adjust this for anti-aliasing (more samples = less noise)
+// Progressive accumulation: average of the samples traced so far, the number
+// of new samples to trace this frame and their weight in the new average
+uniform sampler2D uAccum;
+uniform int uSamples;
+uniform float uBlend;
+
+// Maximum bounces; main.py injects --max-depth as a #define
+#ifndef MAX_DEPTH
+#define MAX_DEPTH 50
+#endif
 
 // -----------------------------------------------------------------------------
 // Pseudo-random generator
@@ -110,12 +120,13 @@ void set_face_normal(in Ray r, in vec3 outward_normal, inout HitRecord rec)
     rec.normal = rec.front_face ? outward_normal : -outward_normal;
 }
 
-bool hit_sphere(Ray r, int i, float t_min, float t_max, out HitRecord rec)
+// Distance t along r to sphere (center, radius) within [t_min, t_max]
+bool hit_sphere(Ray r, vec4 sphere, float t_min, float t_max, out float t)
 {
-    vec3 oc = r.origin - uSphereCenter[i];
+    vec3 oc = r.origin - sphere.xyz;
     float a = dot(r.direction, r.direction);
     float half_b = dot(oc, r.direction);
-    float c = dot(oc, oc) - uSphereRadius[i] * uSphereRadius[i];
+    float c = dot(oc, oc) - sphere.w * sphere.w;
     float discriminant = half_b * half_b - a * c;
     if(discriminant < 0.0)
         return false;
@@ -128,30 +139,68 @@ bool hit_sphere(Ray r, int i, float t_min, float t_max, out HitRecord rec)
             return false;
     }
 
-    rec.t = root;
+    t = root;
+    return true;
+}
+
+// Does r enter the box [lo, hi] between t_min and t_max? (slab test)
+bool hit_box(vec3 origin, vec3 inv_direction, vec3 lo, vec3 hi, float t_min, float t_max)
+{
+    vec3 t0 = (lo - origin) * inv_direction;
+    vec3 t1 = (hi - origin) * inv_direction;
+    vec3 t_near = min(t0, t1);
+    vec3 t_far = max(t0, t1);
+    float enter = max(max(t_near.x, t_near.y), max(t_near.z, t_min));
+    float leave = min(min(t_far.x, t_far.y), min(t_far.z, t_max));
+    return enter <= leave;
+}
+
+// Fill in the hit point, normal and material of sphere i hit at distance t
+void make_hit_record(Ray r, int i, float t, out HitRecord rec)
+{
+    vec4 sphere = texelFetch(uScene, i);
+    rec.t = t;
     rec.p = r.origin + rec.t * r.direction;
-    vec3 outward_normal = (rec.p - uSphereCenter[i]) / uSphereRadius[i];
+    vec3 outward_normal = (rec.p - sphere.xyz) / sphere.w;
     set_face_normal(r, outward_normal, rec);
-    rec.material = uMaterialType[i];
-    rec.albedo   = uSphereAlbedo[i];
-    rec.fuzz     = uSphereFuzz[i];
-    rec.ref_idx  = uSphereRefIdx[i];
-    return true;
+    vec4 material = texelFetch(uScene, uNumSpheres + 2 * i);
+    vec4 params   = texelFetch(uScene, uNumSpheres + 2 * i + 1);
+    rec.material = int(material.w);
+    rec.albedo   = material.rgb;
+    rec.fuzz     = params.x;
+    rec.ref_idx  = params.y;
 }
 
 bool hit_world(Ray r, float t_min, float t_max, out HitRecord rec)
 {
-    bool hit_anything = false;
+    // Walk the BVH in depth-first order without a stack: descend into a
+    // node whose box the ray enters, otherwise jump to its skip link. Only
+    // the geometry is read while searching; the nearest sphere's material
+    // is fetched once at the end.
+    int hit_index = -1;
     float closest_so_far = t_max;
-    HitRecord tempRec;
-    for(int i = 0; i < uNumSpheres; i++) {
-        if(hit_sphere(r, i, t_min, closest_so_far, tempRec)) {
-            hit_anything = true;
-            closest_so_far = tempRec.t;
-            rec = tempRec;
+    vec3 inv_direction = 1.0 / r.direction;
+    int nodes = 3 * uNumSpheres;
+    int node = 0;
+    while(node < uNumNodes) {
+        vec4 lo = texelFetch(uScene, nodes + 2 * node);
+        vec4 hi = texelFetch(uScene, nodes + 2 * node + 1);
+        if(hit_box(r.origin, inv_direction, lo.xyz, hi.xyz, t_min, closest_so_far)) {
+            int i = int(hi.w);
+            float t;
+            if(i >= 0 && hit_sphere(r, texelFetch(uScene, i), t_min, closest_so_far, t)) {
+                hit_index = i;
+                closest_so_far = t;
+            }
+            node++;
         }
+        else
+            node = int(lo.w);
     }
-    return hit_anything;
+    if(hit_index < 0)
+        return false;
+    make_hit_record(r, hit_index, closest_so_far, rec);
+    return true;
 }
 
 vec3 ray_color(Ray r, vec2 seed)
@@ -219,14 +268,15 @@ vec3 ray_color(Ray r, vec2 seed)
 void main()
 {
     vec3 finalColor = vec3(0.0);
-    for(int s = 0; s < SAMPLES; s++)
+    for(int s = 0; s < uSamples; s++)
     {
         float u = TexCoords.x + (rand(TexCoords + vec2(float(s))) - 0.5) / 800.0;
         float v = TexCoords.y + (rand(TexCoords + vec2(float(s+10))) - 0.5) / 600.0;
         Ray r = get_ray(u, v);
         finalColor += ray_color(r, TexCoords + vec2(float(s)*1.234));
     }
-    finalColor /= float(SAMPLES);
-    finalColor = sqrt(finalColor); // Gamma correction (gamma=2.0)
-    FragColor = vec4(finalColor, 1.0);
+    finalColor /= float(uSamples);
+    // Linear colour; gamma correction happens when the average is displayed.
+    vec3 average = texture(uAccum, TexCoords).rgb;
+    FragColor = vec4(mix(average, finalColor, uBlend), 1.0);
 }
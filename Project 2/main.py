@@ -1,10 +1,48 @@
-import glfw
-import numpy as np
-import OpenGL.GL as gl
+import argparse
+import ctypes
+import hashlib
+import os
+import struct
 import sys
+import tempfile
 import time
 import random
 
+import glfw
+import numpy as np
+
+# PyOpenGL picks its platform when it is first imported, so OpenGL.GL is only
+# imported by load_gl(), once the arguments are known. Offscreen runs
+# (--headless) use EGL so that no display is needed; set PYOPENGL_PLATFORM
+# yourself (e.g. to glx) to render into a hidden GLFW window instead.
+gl = None
+GLError = None
+
+def load_gl(headless):
+    """Import OpenGL.GL as gl, on the EGL platform for headless rendering."""
+    global gl, GLError
+    if headless and "PYOPENGL_PLATFORM" not in os.environ and "OpenGL.GL" not in sys.modules:
+        os.environ["PYOPENGL_PLATFORM"] = "egl"
+    import OpenGL.GL
+    import OpenGL.error
+    gl = OpenGL.GL
+    GLError = OpenGL.error.GLError
+
+# --- Progressive rendering settings ---
+# Every frame traces SAMPLES_PER_FRAME new samples per pixel with a fresh seed
+# and blends them into a running average kept in a float texture. Once
+# TARGET_SAMPLES have been accumulated the image is final and nothing is
+# traced until the camera or the scene changes.
+SAMPLES_PER_FRAME = 4
+TARGET_SAMPLES = 1024
+# Degrees per second the arrow keys turn the camera around the scene.
+ORBIT_SPEED = 30.0
+
+# Shader files live next to this script.
+SHADER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Linked shader programs are cached here between runs (see ProgramCache).
+DEFAULT_SHADER_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "glsl-raytracer")
+
 def compile_shader(source, shader_type):
     shader = gl.glCreateShader(shader_type)
     gl.glShaderSource(shader, source)
@@ -14,12 +52,15 @@ def compile_shader(source, shader_type):
         raise RuntimeError("Shader compile error: " + str(err))
     return shader
 
-def create_program(vertex_source, fragment_source):
+def create_program(vertex_source, fragment_source, retrievable=False):
     program = gl.glCreateProgram()
     vertex_shader = compile_shader(vertex_source, gl.GL_VERTEX_SHADER)
     fragment_shader = compile_shader(fragment_source, gl.GL_FRAGMENT_SHADER)
     gl.glAttachShader(program, vertex_shader)
     gl.glAttachShader(program, fragment_shader)
+    if retrievable:
+        # Ask the driver to keep a binary that ProgramCache can save.
+        gl.glProgramParameteri(program, gl.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, gl.GL_TRUE)
     gl.glLinkProgram(program)
     # Check link status
     if not gl.glGetProgramiv(program, gl.GL_LINK_STATUS):
@@ -29,6 +70,128 @@ def create_program(vertex_source, fragment_source):
     gl.glDeleteShader(fragment_shader)
     return program
 
+def inject_defines(source, defines):
+    """Insert a #define for each item of defines right after the #version line."""
+    if not defines:
+        return source
+    version, _, rest = source.partition("\n")
+    lines = [f"#define {name} {value}" for name, value in sorted(defines.items())]
+    return "\n".join([version] + lines + [rest])
+
+# --- Program binary cache ---
+class ProgramCache:
+    """
+    Linked programs saved with glGetProgramBinary and loaded back with
+    glProgramBinary, one file per program in `directory`. The file name is
+    a hash of both shader sources (with the injected defines) and the
+    driver's vendor, renderer and version strings, so editing a shader or
+    changing driver simply selects a different entry. A binary the driver
+    rejects is deleted and the program is compiled again. With directory
+    None, or on drivers without any binary formats (Mesa only offers one
+    while its own shader cache is enabled), every program is compiled.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.enabled = directory is not None and gl.glGetIntegerv(gl.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+        self.driver = "\n".join(gl.glGetString(name).decode()
+                                for name in (gl.GL_VENDOR, gl.GL_RENDERER, gl.GL_VERSION))
+        self.loaded = 0
+        self.compiled = 0
+        self.seconds = 0.0
+
+    def path(self, vertex_source, fragment_source):
+        key = hashlib.sha256("\0".join((self.driver, vertex_source, fragment_source)).encode()).hexdigest()
+        return os.path.join(self.directory, key + ".bin")
+
+    def load(self, path):
+        """Return the program stored at path, or None if there is none or the driver rejects it."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        program = gl.glCreateProgram()
+        if len(data) > 4:
+            binary_format, = struct.unpack("<I", data[:4])
+            try:
+                # Drivers may also reject an unknown format with GL_INVALID_ENUM.
+                gl.glProgramBinary(program, binary_format, data[4:], len(data) - 4)
+                if gl.glGetProgramiv(program, gl.GL_LINK_STATUS):
+                    return program
+            except GLError:
+                pass
+        # Stale or corrupt (e.g. written by an older build of the same driver).
+        gl.glDeleteProgram(program)
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Another process may already have replaced or removed it.
+        return None
+
+    def store(self, path, program):
+        length = gl.glGetProgramiv(program, gl.GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return
+        binary = np.empty(length, dtype=np.uint8)
+        written = gl.GLsizei(0)
+        binary_format = gl.GLenum(0)
+        gl.glGetProgramBinary(program, length, ctypes.byref(written), ctypes.byref(binary_format),
+                              binary.ctypes.data_as(ctypes.c_void_p))
+        temp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a unique temporary file first so a crash never leaves a
+            # truncated entry and concurrent runs never write the same file.
+            fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(struct.pack("<I", binary_format.value) + binary[:written.value].tobytes())
+            os.replace(temp, path)
+        except OSError as e:
+            print(f"Could not write shader cache entry: {e}", file=sys.stderr)
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+
+    def program(self, vertex_source, fragment_source):
+        """Load the linked program from the cache, or compile, link and cache it."""
+        start = time.perf_counter()
+        program = None
+        if self.enabled:
+            path = self.path(vertex_source, fragment_source)
+            program = self.load(path)
+        if program is not None:
+            self.loaded += 1
+        else:
+            program = create_program(vertex_source, fragment_source, retrievable=self.enabled)
+            if self.enabled:
+                self.store(path, program)
+            self.compiled += 1
+        self.seconds += time.perf_counter() - start
+        return program
+
+    def report(self):
+        if self.directory is None:
+            status = f"{self.compiled} compiled, shader cache disabled"
+        elif not self.enabled:
+            status = "this driver has no program binary formats, so nothing is cached"
+        else:
+            status = f"{self.loaded} loaded from {self.directory}, {self.compiled} compiled and cached"
+        return f"Shader programs ready in {1000.0 * self.seconds:.0f} ms ({status})"
+
+def load_program(vertex_file, fragment_file, defines=None, cache=None):
+    """
+    Compile and link a program from two shader files in SHADER_DIR, adding
+    defines to the fragment shader; with a ProgramCache, a cached binary is
+    used when there is one.
+    """
+    sources = []
+    for name in (vertex_file, fragment_file):
+        with open(os.path.join(SHADER_DIR, name), "r") as f:
+            sources.append(f.read())
+    sources[1] = inject_defines(sources[1], defines)
+    if cache is not None:
+        return cache.program(*sources)
+    return create_program(*sources)
+
 # --- Data structure for our scene ---
 # materialType: 0 = Lambertian, 1 = Metal, 2 = Dielectric
 class SphereData:
@@ -40,12 +203,12 @@ class SphereData:
         self.fuzz = fuzz          # float (for Metal)
         self.ref_idx = ref_idx    # float (for Dielectric)
 
-def build_scene():
+def build_scene(num_small_spheres=64, seed=None):
     """
     Build a scene with:
       - A ground sphere
       - Three large spheres
-      - Many small random spheres (increased from 8 to 64)
+      - Many small random spheres (64 by default, placed from seed or the clock)
     """
     spheres = []
 
@@ -74,9 +237,8 @@ def build_scene():
                               albedo=(0.7, 0.6, 0.5),
                               fuzz=0.0))
 
-    # 3) Add many small random spheres (increase this count to 64)
-    random.seed(time.time())  # seed randomness
-    num_small_spheres = 64
+    # 3) Add many small random spheres
+    random.seed(time.time() if seed is None else seed)  # seed randomness
     for _ in range(num_small_spheres):
         # You can adjust these ranges as needed.
         center_x = random.uniform(-8.0, 8.0)
@@ -114,15 +276,16 @@ def build_scene():
     return spheres
 
 # --- Camera parameters ---
-def get_camera_data(window_width, window_height):
+def get_camera_data(window_width, window_height, yaw=0.0):
     """
     Camera settings:
-      - lookfrom: camera position
+      - lookfrom: camera position, turned yaw degrees around the y axis
       - lookat: target point
       - vup: upward vector
       - vfov: vertical field of view (degrees)
     """
-    lookfrom = np.array([13.0, 2.0, 3.0], dtype=np.float32)
+    c, s = np.cos(np.radians(yaw)), np.sin(np.radians(yaw))
+    lookfrom = np.array([13.0 * c + 3.0 * s, 2.0, 3.0 * c - 13.0 * s], dtype=np.float32)
     lookat   = np.array([0.0, 0.0, 0.0], dtype=np.float32)
     vup      = np.array([0.0, 1.0, 0.0], dtype=np.float32)
     vfov     = 30.0
@@ -153,31 +316,219 @@ def get_camera_data(window_width, window_height):
         "lower_left_corner": lower_left_corner
     }
 
-def main():
-    # Initialize GLFW
-    if not glfw.init():
-        print("Could not initialize GLFW")
-        sys.exit(1)
+def upload_camera(program, cam):
+    """Pass camera parameters to the shader."""
+    gl.glUseProgram(program)
+    gl.glUniform3fv(gl.glGetUniformLocation(program, "uCameraOrigin"),    1, cam["origin"])
+    gl.glUniform3fv(gl.glGetUniformLocation(program, "uLowerLeftCorner"), 1, cam["lower_left_corner"])
+    gl.glUniform3fv(gl.glGetUniformLocation(program, "uHorizontal"),      1, cam["horizontal"])
+    gl.glUniform3fv(gl.glGetUniformLocation(program, "uVertical"),        1, cam["vertical"])
 
-    window_width, window_height = 1000, 800
-    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
-    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
-    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
-    window = glfw.create_window(window_width, window_height, "GLSL Raytracer", None, None)
-    if not window:
-        glfw.terminate()
-        sys.exit(1)
-    glfw.make_context_current(window)
+def pack_scene(spheres):
+    """
+    Pack the spheres into one float32 array of RGBA texels, in the layout
+    fragment_shader.glsl reads from uScene:
+      - texels [0, n): center x, y, z and radius of each sphere
+      - texels [n, 3n): per sphere, (albedo r, g, b, materialType) and (fuzz, ref_idx, 0, 0)
+    Geometry comes first so the intersection loop reads consecutive texels.
+    SceneBuffer appends the BVH nodes after the materials.
+    """
+    n = len(spheres)
+    texels = np.zeros((3 * n, 4), dtype=np.float32)
+    texels[:n, :3] = [s.center for s in spheres]
+    texels[:n, 3] = [s.radius for s in spheres]
+    materials = texels[n:].reshape(n, 2, 4)
+    materials[:, 0, :3] = [s.albedo for s in spheres]
+    materials[:, 0, 3] = [s.materialType for s in spheres]
+    materials[:, 1, 0] = [s.fuzz for s in spheres]
+    materials[:, 1, 1] = [s.ref_idx for s in spheres]
+    return texels
+
+# --- Bounding volume hierarchy ---
+def box_areas(lo, hi):
+    d = hi - lo
+    return 2.0 * (d[:, 0] * d[:, 1] + d[:, 1] * d[:, 2] + d[:, 2] * d[:, 0])
+
+def sah_split(lo, hi):
+    """Return (index, cost) of the split of boxes (already sorted along an axis) with the lowest SAH cost."""
+    n = len(lo)
+    # Bounds of boxes[:k + 1] and of boxes[k:] for every k.
+    left_areas = box_areas(np.minimum.accumulate(lo), np.maximum.accumulate(hi))
+    right_areas = box_areas(np.minimum.accumulate(lo[::-1])[::-1], np.maximum.accumulate(hi[::-1])[::-1])
+    k = np.arange(1, n)
+    # Left holds boxes[:k], right holds boxes[k:].
+    cost = left_areas[:-1] * k + right_areas[1:] * (n - k)
+    best = int(np.argmin(cost))
+    return best + 1, cost[best]
+
+def build_bvh(spheres):
+    """
+    Build a BVH over the spheres and flatten it for the shader.
+    Nodes split along the widest centroid axis using the surface area
+    heuristic, and every leaf holds one sphere. Returns (order, nodes):
+      - order: sphere indices in leaf order; the scene is packed in this order
+      - nodes: float32 array (num_nodes, 2, 4), in depth-first order, where
+        node k is (min x, y, z, skip) and (max x, y, z, sphere or -1)
+    A node's first child is the next node. skip is the node after its
+    subtree, where traversal continues when the ray misses its box; this
+    lets the shader walk the tree without a stack. Where the SAH finds no
+    split better than keeping the spheres together (coincident or nested
+    spheres), the node is split at the median instead, so the tree stays
+    balanced.
+    """
+    centers = np.array([s.center for s in spheres], dtype=np.float64).reshape(-1, 3)
+    radii = np.array([s.radius for s in spheres], dtype=np.float64)
+    lo = centers - radii[:, None]
+    hi = centers + radii[:, None]
+    order = []
+    nodes = np.zeros((max(2 * len(spheres) - 1, 0), 2, 4), dtype=np.float32)
+    # Nodes are numbered as they are popped, left child before right, which
+    # gives the depth-first order. A subtree over n spheres has 2n - 1 nodes,
+    # so the skip link is known as soon as a node is numbered.
+    stack = [np.arange(len(spheres))] if spheres else []
+    k = 0
+    while stack:
+        indices = stack.pop()
+        box_lo = lo[indices].min(axis=0)
+        box_hi = hi[indices].max(axis=0)
+        nodes[k, 0, :3] = box_lo
+        nodes[k, 1, :3] = box_hi
+        nodes[k, 0, 3] = k + 2 * len(indices) - 1
+        if len(indices) == 1:
+            nodes[k, 1, 3] = len(order)
+            order.append(int(indices[0]))
+        else:
+            nodes[k, 1, 3] = -1
+            c = centers[indices]
+            extent = c.max(axis=0) - c.min(axis=0)
+            axis = np.argmax(extent)
+            indices = indices[np.argsort(c[:, axis], kind="stable")]
+            split, cost = sah_split(lo[indices], hi[indices])
+            leaf_cost = box_areas(box_lo[None], box_hi[None])[0] * len(indices)
+            if extent[axis] == 0.0 or cost >= leaf_cost:
+                split = len(indices) // 2
+            stack.append(indices[split:])
+            stack.append(indices[:split])
+        k += 1
+    return order, nodes
+
+class SceneBuffer:
+    """
+    The scene as a buffer texture (samplerBuffer uScene in the shader).
+    Uniform arrays are limited to a few thousand components; a buffer
+    texture holds GL_MAX_TEXTURE_BUFFER_SIZE texels, at least 65536 and
+    usually many millions.
+    """
+    TEXTURE_UNIT = 1  # unit 0 is the accumulation texture
+
+    def __init__(self):
+        self.buffer = gl.glGenBuffers(1)
+        self.texture = gl.glGenTextures(1)
+        self.num_spheres = 0
+        self.num_nodes = 0
+
+    def upload(self, spheres):
+        """Replace the scene and its BVH with a single buffer upload."""
+        order, nodes = build_bvh(spheres)
+        texels = np.concatenate((pack_scene([spheres[i] for i in order]), nodes.reshape(-1, 4)))
+        limit = gl.glGetIntegerv(gl.GL_MAX_TEXTURE_BUFFER_SIZE)
+        if len(texels) > limit:
+            raise RuntimeError(f"{len(spheres)} spheres need {len(texels)} texels; "
+                               f"this GPU's buffer textures hold {limit}")
+        gl.glBindBuffer(gl.GL_TEXTURE_BUFFER, self.buffer)
+        gl.glBufferData(gl.GL_TEXTURE_BUFFER, texels.nbytes, texels, gl.GL_STATIC_DRAW)
+        gl.glBindBuffer(gl.GL_TEXTURE_BUFFER, 0)
+        gl.glBindTexture(gl.GL_TEXTURE_BUFFER, self.texture)
+        gl.glTexBuffer(gl.GL_TEXTURE_BUFFER, gl.GL_RGBA32F, self.buffer)
+        self.num_spheres = len(spheres)
+        self.num_nodes = len(nodes)
+
+    def bind(self, program):
+        """Point the shader at the scene; call before drawing."""
+        gl.glUseProgram(program)
+        gl.glActiveTexture(gl.GL_TEXTURE0 + self.TEXTURE_UNIT)
+        gl.glBindTexture(gl.GL_TEXTURE_BUFFER, self.texture)
+        gl.glUniform1i(gl.glGetUniformLocation(program, "uScene"), self.TEXTURE_UNIT)
+        gl.glUniform1i(gl.glGetUniformLocation(program, "uNumSpheres"), self.num_spheres)
+        gl.glUniform1i(gl.glGetUniformLocation(program, "uNumNodes"), self.num_nodes)
+
+# --- Progressive accumulation ---
+class Accumulator:
+    """
+    Running average of the traced samples, kept in two RGBA32F textures.
+    Each frame reads the average so far from one texture and writes the
+    updated average into the other (ping-pong), so the shader never reads
+    the texture it renders to.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.textures = gl.glGenTextures(2)
+        self.fbos = gl.glGenFramebuffers(2)
+        for texture, fbo in zip(self.textures, self.fbos):
+            gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA32F, width, height, 0, gl.GL_RGBA, gl.GL_FLOAT, None)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fbo)
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, texture, 0)
+            if gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER) != gl.GL_FRAMEBUFFER_COMPLETE:
+                raise RuntimeError("Accumulation framebuffer is incomplete")
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        self.current = 0
+        self.reset()
+
+    def reset(self):
+        """Throw the accumulated samples away (after a camera or scene change)."""
+        self.samples = 0
+        for fbo in self.fbos:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fbo)
+            gl.glClearColor(0.0, 0.0, 0.0, 0.0)
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    @property
+    def texture(self):
+        """Texture holding the current average."""
+        return self.textures[self.current]
+
+    def done(self, target=TARGET_SAMPLES):
+        return self.samples >= target
+
+    def add_samples(self, program, vao, scene, samples):
+        """Trace `samples` more samples per pixel of the SceneBuffer scene and blend them into the average."""
+        target = 1 - self.current
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbos[target])
+        gl.glViewport(0, 0, self.width, self.height)
+        scene.bind(program)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glUniform1i(gl.glGetUniformLocation(program, "uAccum"), 0)
+        gl.glUniform1i(gl.glGetUniformLocation(program, "uSamples"), samples)
+        # Blend weight of the new samples, so the result stays an average.
+        gl.glUniform1f(gl.glGetUniformLocation(program, "uBlend"), samples / (self.samples + samples))
+        gl.glUniform1f(gl.glGetUniformLocation(program, "uSeed"), random.uniform(0.0, 1000.0))
+        gl.glBindVertexArray(vao)
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        self.current = target
+        self.samples += samples
 
-    # Load shader sources from files
-    with open("vertex_shader.glsl", "r") as f:
-        vertex_src = f.read()
-    with open("fragment_shader.glsl", "r") as f:
-        fragment_src = f.read()
+    def delete(self):
+        gl.glDeleteFramebuffers(2, self.fbos)
+        gl.glDeleteTextures(self.textures)
 
-    program = create_program(vertex_src, fragment_src)
+def draw_average(program, vao, accumulator, width, height):
+    """Gamma-correct the accumulated average onto the bound framebuffer."""
+    gl.glViewport(0, 0, width, height)
     gl.glUseProgram(program)
+    gl.glActiveTexture(gl.GL_TEXTURE0)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, accumulator.texture)
+    gl.glUniform1i(gl.glGetUniformLocation(program, "uAccum"), 0)
+    gl.glBindVertexArray(vao)
+    gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
+def create_quad_vao(program):
     quad_vertices = np.array([
          # positions (x, y)
          -1.0, -1.0,
@@ -199,82 +550,307 @@ def main():
     gl.glVertexAttribPointer(pos_attrib, 2, gl.GL_FLOAT, gl.GL_FALSE, 2 * quad_vertices.itemsize, gl.ctypes.c_void_p(0))
     gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
     gl.glBindVertexArray(0)
+    return vao
+
+# --- Offscreen rendering ---
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+def create_offscreen_context():
+    """
+    Make an OpenGL 3.3 core context current without showing a window and
+    return a function that destroys it. With PyOpenGL's EGL platform this
+    is a surfaceless EGL context, which works on GPU drivers and on Mesa's
+    software llvmpipe alike; with any other platform it is a hidden GLFW
+    window. Rendering goes to framebuffer objects either way.
+    """
+    from OpenGL import platform
+    if type(platform.PLATFORM).__name__ != "EGLPlatform":
+        if not glfw.init():
+            raise RuntimeError("Could not initialize GLFW")
+        glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+        glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+        glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+        glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+        window = glfw.create_window(16, 16, "GLSL Raytracer", None, None)
+        if not window:
+            glfw.terminate()
+            raise RuntimeError("Could not create a hidden GLFW window")
+        glfw.make_context_current(window)
+        return glfw.terminate
+
+    from OpenGL import EGL, error
+    display = None
+    # Prefer Mesa's surfaceless platform, which needs neither X nor a GPU.
+    for get_display in (lambda: EGL.eglGetPlatformDisplay(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None),
+                        lambda: EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)):
+        try:
+            candidate = get_display()
+            if candidate and EGL.eglInitialize(candidate, None, None):
+                display = candidate
+                break
+        except (error.GLError, error.NullFunctionError):
+            continue
+    if display is None:
+        raise RuntimeError("Could not initialize EGL")
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    # Without a surface no particular config is needed; drivers that list none accept EGL_NO_CONFIG_KHR.
+    config = EGL.EGLConfig()
+    num_configs = EGL.EGLint()
+    config_attribs = (EGL.EGLint * 3)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+    EGL.eglChooseConfig(display, config_attribs, ctypes.pointer(config), 1, ctypes.pointer(num_configs))
+    context_attribs = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                                       EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                                       EGL.EGL_NONE)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, context_attribs)
+    if not context or not EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context):
+        EGL.eglTerminate(display)
+        raise RuntimeError("Could not create a surfaceless OpenGL 3.3 context")
+
+    def destroy():
+        EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(display, context)
+        EGL.eglTerminate(display)
+    return destroy
+
+class Readback:
+    """
+    Copies finished images back to the CPU through a ring of pixel buffer
+    objects. start() draws the gamma-corrected average into an 8-bit
+    framebuffer and queues glReadPixels into the next buffer, which returns
+    at once; collect() only fetches an image after the GPU has signalled its
+    fence. The CPU can therefore queue the next image's samples while
+    earlier ones are still being traced and transferred.
+    """
+    def __init__(self, width, height, depth=3):
+        self.width = width
+        self.height = height
+        self.size = width * height * 4
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA8, width, height, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+        self.fbo = gl.glGenFramebuffers(1)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, self.texture, 0)
+        if gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER) != gl.GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Readback framebuffer is incomplete")
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        self.pbos = list(gl.glGenBuffers(depth))
+        for pbo in self.pbos:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, self.size, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.next = 0
+        self.pending = []  # (pbo, fence, tag), oldest first
+        self.finished = []
+
+    def start(self, display_program, vao, accumulator, tag):
+        """Queue the readback of the accumulator's current average; collect() later returns it with tag."""
+        if len(self.pending) == len(self.pbos):
+            # Every buffer is in flight: wait for the oldest.
+            ready = self.collect(wait=True, limit=1)
+            self.finished.extend(ready)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        draw_average(display_program, vao, accumulator, self.width, self.height)
+        pbo = self.pbos[self.next]
+        self.next = (self.next + 1) % len(self.pbos)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+        gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        self.pending.append((pbo, gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0), tag))
+        gl.glFlush()
+
+    def collect(self, wait=False, limit=None):
+        """
+        Return [(tag, image)] for the queued readbacks that are complete, in
+        the order they were started; images are (height, width, 3) uint8,
+        top row first. With wait=True, block until they all are (or until
+        limit more have completed).
+        """
+        done = []
+        while self.pending and (limit is None or len(done) < limit):
+            pbo, fence, tag = self.pending[0]
+            status = gl.glClientWaitSync(fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT,
+                                         gl.GL_TIMEOUT_IGNORED if wait else 0)
+            if status not in (gl.GL_ALREADY_SIGNALED, gl.GL_CONDITION_SATISFIED):
+                break
+            gl.glDeleteSync(fence)
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+            pixels = gl.glGetBufferSubData(gl.GL_PIXEL_PACK_BUFFER, 0, self.size)
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+            image = np.frombuffer(pixels, dtype=np.uint8).reshape(self.height, self.width, 4)
+            done.append((tag, image[::-1, :, :3]))
+            self.pending.pop(0)
+        done, self.finished = self.finished + done, []
+        return done
+
+def write_png(path, image):
+    """Write a (height, width, 3) uint8 image as an 8-bit RGB PNG."""
+    # Pillow is only needed for --headless.
+    from PIL import Image
+    Image.fromarray(image, "RGB").save(path)
+
+def output_path(pattern, index, count):
+    """'render.png' -> 'render_0003.png' when there are several images; a {} field in the pattern is filled in."""
+    if "{" in pattern:
+        return pattern.format(index)
+    if count == 1:
+        return pattern
+    root, ext = os.path.splitext(pattern)
+    return f"{root}_{index:04d}{ext}"
+
+def render_offscreen(args):
+    """
+    --headless: render one image per camera angle to PNG files in a single
+    process and context. The scene is uploaded once; each view accumulates
+    args.samples samples and is read back asynchronously while the next
+    view is traced.
+    """
+    destroy_context = create_offscreen_context()
+    try:
+        print(f"Renderer: {gl.glGetString(gl.GL_RENDERER).decode()}", file=sys.stderr)
+        program, display_program = load_programs(args)
+        vao = create_quad_vao(program)
+        scene = SceneBuffer()
+        scene.upload(build_scene(args.spheres, args.seed))
+        accumulator = Accumulator(args.width, args.height)
+        readback = Readback(args.width, args.height)
+        yaws = [360.0 * k / args.orbit for k in range(args.orbit)] if args.orbit else args.yaw
+
+        def save(finished):
+            for index, image in finished:
+                path = output_path(args.output, index, len(yaws))
+                write_png(path, image)
+                print(f"Saved {path} ({time.perf_counter() - start:.2f}s)", file=sys.stderr)
+
+        start = time.perf_counter()
+        for index, yaw in enumerate(yaws):
+            upload_camera(program, get_camera_data(args.width, args.height, yaw))
+            accumulator.reset()
+            while not accumulator.done(args.samples):
+                accumulator.add_samples(program, vao, scene, min(SAMPLES_PER_FRAME, args.samples - accumulator.samples))
+            readback.start(display_program, vao, accumulator, index)
+            save(readback.collect())
+        save(readback.collect(wait=True))
+        total = time.perf_counter() - start
+        print(f"Rendered {len(yaws)} images of {args.width}x{args.height} at {args.samples} samples in {total:.2f}s "
+              f"({total / len(yaws):.2f}s per image)", file=sys.stderr)
+    finally:
+        destroy_context()
+
+def load_programs(args):
+    """The tracing and display programs, through the shader cache unless --no-shader-cache."""
+    cache = ProgramCache(None if args.no_shader_cache else args.shader_cache)
+    program = load_program("vertex_shader.glsl", "fragment_shader.glsl", {"MAX_DEPTH": args.max_depth}, cache)
+    display_program = load_program("vertex_shader.glsl", "display_shader.glsl", cache=cache)
+    print(cache.report(), file=sys.stderr)
+    return program, display_program
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GLSL path tracer.")
+    parser.add_argument("--width", type=int, default=1000)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--samples", type=int, default=TARGET_SAMPLES,
+                        help="samples per pixel to accumulate before the image is final")
+    parser.add_argument("--spheres", type=int, default=64, help="number of small random spheres")
+    parser.add_argument("--max-depth", type=int, default=50, help="maximum bounces per path")
+    parser.add_argument("--seed", type=float, default=None,
+                        help="seed for the sphere placement (default: the clock)")
+    parser.add_argument("--headless", action="store_true",
+                        help="render offscreen and write PNG files instead of opening a window")
+    parser.add_argument("--yaw", type=float, nargs="+", default=[0.0],
+                        help="camera angles in degrees around the scene; --headless writes one image per angle")
+    parser.add_argument("--orbit", type=int, default=None, metavar="N",
+                        help="--headless: N images evenly spaced around the scene instead of --yaw")
+    parser.add_argument("--output", default="render.png",
+                        help="--headless: PNG path; several images are numbered, or use a pattern like f_{:03d}.png")
+    parser.add_argument("--shader-cache", default=DEFAULT_SHADER_CACHE, metavar="DIR",
+                        help="directory for cached shader program binaries")
+    parser.add_argument("--no-shader-cache", action="store_true",
+                        help="always compile the shaders (to compare startup times)")
+    args = parser.parse_args(argv)
+    for name in ("width", "height", "samples", "max_depth", "orbit"):
+        value = getattr(args, name)
+        if value is not None and value < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if args.spheres < 0:
+        parser.error("--spheres must not be negative")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_gl(args.headless)
+    if args.headless:
+        render_offscreen(args)
+        return
+
+    # Initialize GLFW
+    if not glfw.init():
+        print("Could not initialize GLFW")
+        sys.exit(1)
 
-    # Pass camera parameters to the shader
-    cam = get_camera_data(window_width, window_height)
-    loc_origin     = gl.glGetUniformLocation(program, "uCameraOrigin")
-    loc_llc        = gl.glGetUniformLocation(program, "uLowerLeftCorner")
-    loc_horizontal = gl.glGetUniformLocation(program, "uHorizontal")
-    loc_vertical   = gl.glGetUniformLocation(program, "uVertical")
+    window_width, window_height = args.width, args.height
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    window = glfw.create_window(window_width, window_height, "GLSL Raytracer", None, None)
+    if not window:
+        glfw.terminate()
+        sys.exit(1)
+    glfw.make_context_current(window)
 
-    gl.glUniform3fv(loc_origin,     1, cam["origin"])
-    gl.glUniform3fv(loc_llc,        1, cam["lower_left_corner"])
-    gl.glUniform3fv(loc_horizontal, 1, cam["horizontal"])
-    gl.glUniform3fv(loc_vertical,   1, cam["vertical"])
+    # Load shader sources from files (or their cached binaries)
+    program, display_program = load_programs(args)
+    vao = create_quad_vao(program)
+
+    # The accumulation textures match the framebuffer, which may be larger than the window on HiDPI screens.
+    width, height = glfw.get_framebuffer_size(window)
+    accumulator = Accumulator(width, height)
+    yaw = args.yaw[0]
+    upload_camera(program, get_camera_data(width, height, yaw))
 
     # Build the random scene
-    spheres = build_scene()
-    num_spheres = len(spheres)
-
-    # Set our new maximum spheres count (here we allow up to 128)
-    MAX_SPHERES = 128
-    if num_spheres > MAX_SPHERES:
-        print(f"Truncating sphere list from {num_spheres} to {MAX_SPHERES}")
-        spheres = spheres[:MAX_SPHERES]
-        num_spheres = MAX_SPHERES
-
-    loc_numSpheres = gl.glGetUniformLocation(program, "uNumSpheres")
-    gl.glUniform1i(loc_numSpheres, num_spheres)
-
-    # Prepare arrays for uniform data
-    centers = []
-    radii   = []
-    matTypes= []
-    albedos = []
-    fuzzes  = []
-    refidx  = []
-
-    for s in spheres:
-        centers.extend([s.center[0], s.center[1], s.center[2]])
-        radii.append(s.radius)
-        matTypes.append(s.materialType)
-        albedos.extend([s.albedo[0], s.albedo[1], s.albedo[2]])
-        fuzzes.append(s.fuzz)
-        refidx.append(s.ref_idx)
-
-    centers = np.array(centers, dtype=np.float32)
-    radii   = np.array(radii,   dtype=np.float32)
-    matTypes= np.array(matTypes, dtype=np.int32)
-    albedos = np.array(albedos,  dtype=np.float32)
-    fuzzes  = np.array(fuzzes,   dtype=np.float32)
-    refidx  = np.array(refidx,   dtype=np.float32)
-
-    loc_center  = gl.glGetUniformLocation(program, "uSphereCenter")
-    loc_radius  = gl.glGetUniformLocation(program, "uSphereRadius")
-    loc_matType = gl.glGetUniformLocation(program, "uMaterialType")
-    loc_albedo  = gl.glGetUniformLocation(program, "uSphereAlbedo")
-    loc_fuzz    = gl.glGetUniformLocation(program, "uSphereFuzz")
-    loc_refidx  = gl.glGetUniformLocation(program, "uSphereRefIdx")
-
-    gl.glUniform3fv(loc_center,  num_spheres, centers)
-    gl.glUniform1fv(loc_radius,  num_spheres, radii)
-    gl.glUniform1iv(loc_matType, num_spheres, matTypes)
-    gl.glUniform3fv(loc_albedo,  num_spheres, albedos)
-    gl.glUniform1fv(loc_fuzz,    num_spheres, fuzzes)
-    gl.glUniform1fv(loc_refidx,  num_spheres, refidx)
-
-    # Seed for random number generation
-    loc_seed = gl.glGetUniformLocation(program, "uSeed")
-    gl.glUniform1f(loc_seed, time.time() % 1000)
+    scene = SceneBuffer()
+    scene.upload(build_scene(args.spheres, args.seed))
+
+    # R builds a new random scene; the arrow keys turn the camera.
+    def on_key(window, key, scancode, action, mods):
+        if key == glfw.KEY_R and action == glfw.PRESS:
+            scene.upload(build_scene(args.spheres))
+            accumulator.reset()
+    glfw.set_key_callback(window, on_key)
 
     # Main render loop
+    last_time = time.perf_counter()
     while not glfw.window_should_close(window):
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT)
-        gl.glUseProgram(program)
-        gl.glBindVertexArray(vao)
-        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+        now = time.perf_counter()
+        dt, last_time = now - last_time, now
+
+        turn = (glfw.get_key(window, glfw.KEY_RIGHT) == glfw.PRESS) - (glfw.get_key(window, glfw.KEY_LEFT) == glfw.PRESS)
+        size = glfw.get_framebuffer_size(window)
+        if size != (width, height) and min(size) > 0:
+            width, height = size
+            accumulator.delete()
+            accumulator = Accumulator(width, height)
+            upload_camera(program, get_camera_data(width, height, yaw))
+        elif turn:
+            yaw += turn * ORBIT_SPEED * dt
+            upload_camera(program, get_camera_data(width, height, yaw))
+            accumulator.reset()
+
+        if not accumulator.done(args.samples):
+            accumulator.add_samples(program, vao, scene, min(SAMPLES_PER_FRAME, args.samples - accumulator.samples))
+            glfw.set_window_title(window, f"GLSL Raytracer - {accumulator.samples}/{args.samples} samples")
+        draw_average(display_program, vao, accumulator, width, height)
         glfw.swap_buffers(window)
-        glfw.poll_events()
+        if accumulator.done(args.samples):
+            # Nothing left to trace: sleep until something happens. The
+            # sleep is not time the arrow keys were held, so it is not
+            # counted towards the next frame's turn.
+            glfw.wait_events()
+            last_time = time.perf_counter()
+        else:
+            glfw.poll_events()
 
     glfw.terminate()
 